@@ -0,0 +1,377 @@
+"""Алерты по правилам: оценка, вход цены в пивот-зону, STRONG, RSI.
+
+Правила читаются из JSON-файла SCREENER_ALERT_RULES и проверяются пачкой по
+всем активам после закрытия часового бара - по состоянию индикаторов из
+live-режима, без пересчета истории. Алерт срабатывает, когда условие
+становится истинным; пока оно держится, повторов нет.
+"""
+
+import os
+import json
+import asyncio
+import tempfile
+import traceback
+import urllib.request
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from .live import alert_metrics
+from .cache import UpstreamError
+
+ALERT_RULES_FILE = os.getenv("SCREENER_ALERT_RULES")
+ALERT_INTERVAL = int(os.getenv("SCREENER_ALERT_INTERVAL", "60"))
+ALERT_SINKS = [s.strip() for s in os.getenv("SCREENER_ALERT_SINKS", "log").split(",") if s.strip()]
+ALERT_FILE = os.getenv("SCREENER_ALERT_FILE", "alerts.jsonl")
+ALERT_WEBHOOK = os.getenv("SCREENER_ALERT_WEBHOOK")
+ALERT_WEBHOOK_TIMEOUT = float(os.getenv("SCREENER_ALERT_WEBHOOK_TIMEOUT", "5"))
+ALERTS_KEPT = 200
+# Проверяет правила только процесс, захвативший этот файл (остальные воркеры uvicorn - нет)
+ALERT_LOCK_FILE = os.getenv("SCREENER_ALERT_LOCK", os.path.join(tempfile.gettempdir(), "screener-alerts.lock"))
+
+RULE_KINDS = {
+    "score_above": "оценка выше",
+    "score_below": "оценка ниже",
+    "in_zone": "цена в зоне",
+    "strong": "STRONG",
+    "rsi_above": "RSI 14d выше",
+    "rsi_below": "RSI 14d ниже",
+}
+
+# Направление -> код в матрицах (0 - по текущему trend_mode / любое)
+DIRECTIONS = {"bullish": 1, "bearish": -1, "neutral": 2}
+ZONE_SIDES = {"buy": 1, "sell": -1}
+ZONE_NAMES = {1: "Buy Zone", -1: "Sell Zone"}
+
+_rules = None       # скомпилированные правила
+_prev = None        # условия на прошлой проверке: правило x актив
+_last_bars = {}     # ticker -> последний закрытый бар на прошлой проверке
+_recent = deque(maxlen=ALERTS_KEPT)
+_task = None
+_lock_file = None
+
+
+def compile_rules(rules, tickers, formula_types):
+    """Проверяет правила и раскладывает их по массивам для пакетной оценки.
+
+    Правило: {"id": "btc-score", "kind": "score_above", "value": 3.0,
+    "formula": "intraday_local", "tickers": ["BTC-USD"]}. Для in_zone -
+    "side": buy/sell (по умолчанию по текущему тренду), для strong -
+    "direction": bullish/bearish.
+    """
+    formula_types = list(formula_types)
+    column = {ticker: i for i, ticker in enumerate(tickers)}
+    seen = set()
+
+    ids, kinds, values, formulas, params = [], [], [], [], []
+    mask = np.zeros((len(rules), len(tickers)), dtype=bool)
+    for i, rule in enumerate(rules):
+        rule_id = str(rule.get('id', i))
+        if rule_id in seen:
+            raise ValueError(f"Правило {rule_id}: повторяющийся id")
+        seen.add(rule_id)
+
+        kind = rule.get('kind')
+        if kind not in RULE_KINDS:
+            raise ValueError(f"Правило {rule_id}: неизвестный тип {kind}")
+        formula = rule.get('formula', 'intraday_local')
+        if formula not in formula_types:
+            raise ValueError(f"Правило {rule_id}: неизвестная формула {formula}")
+
+        value = rule.get('value')
+        if kind in ('score_above', 'score_below', 'rsi_above', 'rsi_below'):
+            if not isinstance(value, (int, float)):
+                raise ValueError(f"Правило {rule_id}: нужен числовой порог value")
+        param = 0
+        if kind == 'in_zone' and rule.get('side') is not None:
+            if rule['side'] not in ZONE_SIDES:
+                raise ValueError(f"Правило {rule_id}: side должен быть buy или sell")
+            param = ZONE_SIDES[rule['side']]
+        if kind == 'strong' and rule.get('direction') is not None:
+            if rule['direction'] not in DIRECTIONS:
+                raise ValueError(f"Правило {rule_id}: неизвестное направление {rule['direction']}")
+            param = DIRECTIONS[rule['direction']]
+
+        targets = rule.get('tickers')
+        if targets is None:
+            mask[i] = True
+        else:
+            unknown = [t for t in targets if t not in column]
+            if unknown:
+                raise ValueError(f"Правило {rule_id}: неизвестные активы {', '.join(unknown)}")
+            mask[i, [column[t] for t in targets]] = True
+
+        ids.append(rule_id)
+        kinds.append(kind)
+        values.append(float(value) if value is not None else np.nan)
+        formulas.append(formula_types.index(formula))
+        params.append(param)
+
+    return {
+        'ids': ids,
+        'kinds': np.array(kinds, dtype=object),
+        'values': np.array(values, dtype=float),
+        'formulas': np.array(formulas, dtype=int),
+        'params': np.array(params, dtype=int),
+        'mask': mask,
+        'tickers': list(tickers),
+        'formula_types': formula_types,
+    }
+
+
+def load_rules(path):
+    with open(path, encoding='utf-8') as f:
+        rules = json.load(f)
+    if not isinstance(rules, list):
+        raise ValueError(f"{path}: ожидается JSON-список правил")
+    return rules
+
+
+def _metric_arrays(metrics, tickers, formula_types):
+    """Метрики активов -> массивы по активам (NaN - значения нет)"""
+    n = len(tickers)
+    arrays = {
+        'valid': np.zeros(n, dtype=bool),
+        'score': np.full((len(formula_types), n), np.nan),
+        'mode': np.zeros((len(formula_types), n), dtype=int),
+        'price': np.full(n, np.nan),
+        'M2': np.full(n, np.nan),
+        'PP': np.full(n, np.nan),
+        'M3': np.full(n, np.nan),
+        'strong': np.zeros(n, dtype=int),
+        'rsi': np.full(n, np.nan),
+    }
+    for j, ticker in enumerate(tickers):
+        m = metrics.get(ticker)
+        if m is None:
+            continue
+        arrays['valid'][j] = True
+        arrays['price'][j] = m['price']
+        for level in ('M2', 'PP', 'M3'):
+            arrays[level][j] = m['zone'][level]
+        for f, formula_type in enumerate(formula_types):
+            if formula_type in m['scores']:
+                score, mode = m['scores'][formula_type]
+                arrays['score'][f, j] = score
+                arrays['mode'][f, j] = 1 if mode == "bullish" else -1
+        if m['strong'] is not None:
+            arrays['strong'][j] = DIRECTIONS[m['strong']]
+        if m['rsi'] is not None:
+            arrays['rsi'][j] = m['rsi']
+    return arrays
+
+
+def evaluate(rules, arrays):
+    """Условия всех правил по всем активам: матрица правило x актив"""
+    kinds = rules['kinds']
+    values = rules['values'][:, None]
+    score = arrays['score'][rules['formulas']]
+    mode = arrays['mode'][rules['formulas']]
+    price = arrays['price']
+
+    # Сравнения с NaN дают False - актив без данных не срабатывает
+    with np.errstate(invalid='ignore'):
+        bull_zone = ((price >= np.fmin(arrays['M2'], arrays['PP'])) &
+                     (price <= np.fmax(arrays['M2'], arrays['PP'])))
+        bear_zone = ((price >= np.fmin(arrays['PP'], arrays['M3'])) &
+                     (price <= np.fmax(arrays['PP'], arrays['M3'])))
+        side = np.where(rules['params'][:, None] != 0, rules['params'][:, None], mode)
+        conditions = {
+            'score_above': score > values,
+            'score_below': score < values,
+            'in_zone': ((side == 1) & bull_zone) | ((side == -1) & bear_zone),
+            'strong': np.where(rules['params'][:, None] == 0,
+                               arrays['strong'] != 0,
+                               arrays['strong'] == rules['params'][:, None]),
+            'rsi_above': arrays['rsi'] > values,
+            'rsi_below': arrays['rsi'] < values,
+        }
+
+    cond = np.zeros(rules['mask'].shape, dtype=bool)
+    for kind, matrix in conditions.items():
+        rows = kinds == kind
+        cond[rows] = np.broadcast_to(matrix, cond.shape)[rows]
+    return cond & rules['mask'] & arrays['valid']
+
+
+def _alert(rules, i, j, arrays, metrics, names):
+    """Описание сработавшего правила i по активу j"""
+    ticker = rules['tickers'][j]
+    kind = rules['kinds'][i]
+    f = rules['formulas'][i]
+    if kind in ('score_above', 'score_below'):
+        value = float(arrays['score'][f, j])
+        detail = f"{value:.2f} (порог {rules['values'][i]:g})"
+    elif kind in ('rsi_above', 'rsi_below'):
+        value = float(arrays['rsi'][j])
+        detail = f"{value:.1f} (порог {rules['values'][i]:g})"
+    elif kind == 'in_zone':
+        side = rules['params'][i] or arrays['mode'][f, j]
+        value = float(arrays['price'][j])
+        detail = f"{ZONE_NAMES[side]}, цена {value:.4f}"
+    else:
+        value = {code: name for name, code in DIRECTIONS.items()}[arrays['strong'][j]]
+        detail = value
+
+    return {
+        'rule': rules['ids'][i],
+        'kind': kind,
+        'ticker': ticker,
+        'name': names.get(ticker, ticker),
+        'bar': metrics[ticker]['last_bar'].isoformat(),
+        'value': value,
+        'message': f"{names.get(ticker, ticker)} ({ticker}): {RULE_KINDS[kind]} - {detail}",
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+
+
+def log_sink(alerts):
+    for alert in alerts:
+        print(f"[ALERT] {alert['rule']}: {alert['message']}")
+
+
+def file_sink(alerts):
+    with open(ALERT_FILE, 'a', encoding='utf-8') as f:
+        for alert in alerts:
+            f.write(json.dumps(alert, ensure_ascii=False) + "\n")
+
+
+def webhook_sink(alerts):
+    if not ALERT_WEBHOOK:
+        return
+    request = urllib.request.Request(
+        ALERT_WEBHOOK,
+        data=json.dumps({'alerts': alerts}, ensure_ascii=False).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        method='POST')
+    with urllib.request.urlopen(request, timeout=ALERT_WEBHOOK_TIMEOUT):
+        pass
+
+
+SINKS = {
+    "log": log_sink,
+    "file": file_sink,
+    "webhook": webhook_sink,
+}
+
+
+def register_sink(name, sink):
+    """Добавить получателя алертов: sink(alerts) получает список словарей"""
+    SINKS[name] = sink
+
+
+def dispatch(alerts):
+    for name in ALERT_SINKS:
+        try:
+            SINKS[name](alerts)
+        except Exception as e:
+            # Ошибка одного получателя не мешает остальным
+            print(f"Алерты: получатель {name} недоступен: {e}")
+
+
+def configure(rules, tickers, formula_types):
+    """Компилирует правила; первая проверка после этого только запоминает условия"""
+    global _rules, _prev
+    _rules = compile_rules(rules, tickers, formula_types)
+    _prev = None
+    _last_bars.clear()
+
+
+def evaluate_once(names):
+    """Одна проверка всех правил; names - ticker -> название. Возвращает новые алерты"""
+    global _prev
+    if _rules is None:
+        return []
+
+    metrics = {}
+    for ticker in _rules['tickers']:
+        try:
+            metrics[ticker] = alert_metrics(ticker, _rules['formula_types'])
+        except UpstreamError as e:
+            print(f"Алерты: {ticker} пропущен: {e}")
+            metrics[ticker] = None
+
+    last_bars = {t: m['last_bar'] for t, m in metrics.items() if m is not None}
+    if _prev is not None and last_bars.items() <= _last_bars.items():
+        return []   # новых закрытых баров нет
+
+    arrays = _metric_arrays(metrics, _rules['tickers'], _rules['formula_types'])
+    cond = evaluate(_rules, arrays)
+    if _prev is None:
+        # При старте условия, которые уже выполнены, не считаются новыми
+        fired = np.zeros_like(cond)
+    else:
+        fired = cond & ~_prev
+    # У актива без данных помним прошлое состояние, чтобы не сработать повторно
+    _prev = np.where(arrays['valid'], cond, _prev if _prev is not None else False)
+    _last_bars.update(last_bars)
+
+    alerts = [_alert(_rules, i, j, arrays, metrics, names) for i, j in zip(*np.nonzero(fired))]
+    if alerts:
+        _recent.extend(alerts)
+        dispatch(alerts)
+    return alerts
+
+
+def recent_alerts():
+    return list(_recent)
+
+
+def rules_count():
+    return 0 if _rules is None else len(_rules['ids'])
+
+
+async def _run(names):
+    while True:
+        try:
+            await run_in_threadpool(evaluate_once, names)
+        except Exception:
+            traceback.print_exc()
+        await asyncio.sleep(ALERT_INTERVAL)
+
+
+def _acquire_lock():
+    """Неблокирующая блокировка ALERT_LOCK_FILE; ОС снимает ее, если процесс упал"""
+    f = open(ALERT_LOCK_FILE, 'a+')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def start(assets, formula_types):
+    """Запускает фоновую проверку, если задан файл правил.
+
+    При нескольких воркерах (run_server.py --prod) проверку ведет один процесс -
+    иначе каждый алерт уходил бы получателям по разу от каждого воркера.
+    """
+    global _task, _lock_file
+    if not ALERT_RULES_FILE:
+        return
+    configure(load_rules(ALERT_RULES_FILE), [a['ticker'] for a in assets], formula_types)
+    _lock_file = _acquire_lock()
+    if _lock_file is None:
+        print(f"Алерты: правила проверяет другой процесс ({ALERT_LOCK_FILE})")
+        return
+    names = {a['ticker']: a['name'] for a in assets}
+    _task = asyncio.create_task(_run(names))
+    print(f"Алерты: {rules_count()} правил, проверка каждые {ALERT_INTERVAL} с")
+
+
+def stop():
+    global _task, _lock_file
+    if _task is not None:
+        _task.cancel()
+        _task = None
+    if _lock_file is not None:
+        _lock_file.close()
+        _lock_file = None
@@ -0,0 +1,334 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime
+
+import pandas as pd
+import yfinance as yf
+
+from .utils import normalize_df, to_msk, resample_bars, aggregate_bars, RESAMPLE_RULES, OHLCV_AGG
+from .lookback import retention
+
+# Настройки stale-while-revalidate (секунды)
+CACHE_FRESH_SECONDS = int(os.getenv("SCREENER_CACHE_FRESH", "900"))
+CACHE_MAX_STALENESS = int(os.getenv("SCREENER_MAX_STALENESS", "21600"))
+UPSTREAM_TIMEOUT = float(os.getenv("SCREENER_UPSTREAM_TIMEOUT", "20"))
+MIN_BARS = 50
+
+# История грузится один раз на глубину, объявленную потребителями (app/lookback.py),
+# дальше докачиваются только бары после последнего закэшированного
+HOURLY_MAX_DAYS = 728                # Yahoo отдает часовые бары не глубже 730 дней
+RECENT_DAYS = int(os.getenv("SCREENER_RECENT_DAYS", "5"))
+# Часовой хвост покрывает текущую неделю и запас докачки - из него пересобираются 4h/1d/1w
+HOURLY_MIN_DAYS = RECENT_DAYS + 8
+
+# Circuit breaker: после N ошибок подряд не ходим в Yahoo до истечения паузы
+BREAKER_THRESHOLD = int(os.getenv("SCREENER_BREAKER_THRESHOLD", "3"))
+BREAKER_COOLDOWN = int(os.getenv("SCREENER_BREAKER_COOLDOWN", "300"))
+
+# Бюджет памяти под закэшированные изображения (графики, обзоры), мегабайты
+DERIVED_MAX_MB = int(os.getenv("SCREENER_DERIVED_MAX_MB", "64"))
+
+
+class UpstreamError(Exception):
+    """Upstream недоступен и в кэше нет пригодных данных"""
+
+
+_lock = threading.Lock()
+_history = {}        # ticker -> {'bars': {timeframe: DataFrame}, 'as_of': timestamp}
+_long = {}           # ticker -> {timeframe: DataFrame}: длинная 4h/1d/1w история по запросу
+_derived = OrderedDict()     # key -> (as_of, value, nbytes), в порядке последнего обращения
+_derived_bytes = 0
+_refreshing = set()
+_breaker = {'failures': 0, 'opened_at': None}
+
+# Отдельные пулы: фоновое обновление ждет загрузку и не должно занимать ее потоки
+_upstream_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="upstream")
+_refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="revalidate")
+
+
+def format_as_of(as_of):
+    """Время загрузки данных для отображения"""
+    return datetime.fromtimestamp(as_of).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _breaker_allows():
+    with _lock:
+        opened_at = _breaker['opened_at']
+        if opened_at is None:
+            return True
+        if time.time() - opened_at >= BREAKER_COOLDOWN:
+            # Half-open: пропускаем одну пробную загрузку, остальные ждут новую паузу
+            _breaker['opened_at'] = time.time()
+            return True
+        return False
+
+
+def _record_result(ok):
+    with _lock:
+        if ok:
+            _breaker['failures'] = 0
+            _breaker['opened_at'] = None
+        else:
+            _breaker['failures'] += 1
+            if _breaker['failures'] >= BREAKER_THRESHOLD:
+                _breaker['opened_at'] = time.time()
+
+
+def _download(ticker, interval="1h", min_bars=MIN_BARS, **span):
+    """Загрузка баров с таймаутом и учетом circuit breaker (span: period или start/end)"""
+    if not _breaker_allows():
+        raise UpstreamError("upstream временно отключен (circuit breaker)")
+
+    future = _upstream_pool.submit(yf.download, ticker, interval=interval, progress=False, **span)
+    try:
+        df = normalize_df(future.result(timeout=UPSTREAM_TIMEOUT))
+    except FutureTimeout:
+        _record_result(False)
+        raise UpstreamError(f"таймаут загрузки ({UPSTREAM_TIMEOUT:.0f}s)")
+    except Exception as e:
+        _record_result(False)
+        raise UpstreamError(str(e))
+
+    # Мало баров - проблема этого тикера (редкие торги, делистинг), а не Yahoo:
+    # общий breaker считает только таймауты и ошибки загрузки
+    if len(df) < min_bars:
+        raise UpstreamError("insufficient data")
+
+    _record_result(True)
+    return df
+
+
+def _days_ago(days):
+    return (pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def _period_start(timeframe, t):
+    """Начало периода старшего ТФ, в который попадает бар t (МСК)"""
+    day = t.normalize()
+    if timeframe == '4h':
+        return day + pd.Timedelta(hours=t.hour // 4 * 4)
+    if timeframe == '1w':
+        return day - pd.Timedelta(days=t.weekday())
+    return day
+
+
+def _cold_fetch(ticker, need):
+    """Первая загрузка: часовые бары на глубину 1h/4h, дальше - дневной интервал"""
+    # Глубина в днях для круглосуточного актива; у биржевых часов в сутках меньше
+    days = min(HOURLY_MAX_DAYS, -(-max(need['1h'], need['4h'] * 4) // 24) + HOURLY_MIN_DAYS)
+    hourly = _download(ticker, start=_days_ago(days))
+
+    got_4h = len(resample_bars(to_msk(hourly.copy()), '4h'))
+    if got_4h < need['4h'] and days < HOURLY_MAX_DAYS:
+        # Торговая сессия короче суток: догружаем раньше пропорционально нехватке
+        more = min(HOURLY_MAX_DAYS, int(days * need['4h'] / max(got_4h, 1) * 1.1) + 1)
+        end = (hourly.index[0] + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        earlier = _download(ticker, min_bars=1, start=_days_ago(more), end=end)
+        hourly = pd.concat([earlier[earlier.index < hourly.index[0]], hourly])
+
+    bars = aggregate_bars(hourly)
+
+    # Длинная дневная/недельная история - из дневного интервала: в 24 раза меньше строк.
+    # Дневной бар Yahoo - сессия биржи или сутки UTC, а не МСК-сутки, и точно пересобрать
+    # его по МСК без часовых баров нельзя. Поэтому такие бары идут только раньше часовой
+    # истории и служат прогревом EMA 1d/1w; все дни внутри часовой истории, RSI и пивоты
+    # считаются по МСК, а вклад прогрева в EMA затухает с каждым периодом.
+    daily_days = max(-(-need['1d'] * 7 // 5), need['1w'] * 7) + 7
+    first_day = bars['1h'].index[0].normalize() + pd.Timedelta(days=1)
+    if daily_days > (bars['1h'].index[-1] - first_day).days:
+        daily = _download(ticker, interval="1d", min_bars=1, start=_days_ago(daily_days),
+                          end=first_day.strftime('%Y-%m-%d'))
+        daily = daily[list(OHLCV_AGG)]
+        daily.index = pd.DatetimeIndex(daily.index.date).tz_localize('Europe/Moscow')
+        # Первый (неполный) день часовой истории тоже берем из дневного интервала
+        bars['1d'] = pd.concat([daily[daily.index < first_day],
+                                bars['1d'][bars['1d'].index >= first_day]])
+        bars['1w'] = resample_bars(bars['1d'], '1w')
+
+    return bars
+
+
+def _merge_recent(bars, recent):
+    """Часовые бары с последних дней кэша заменяют хвост истории.
+
+    Старшие ТФ пересобираются только в периодах, которых коснулись новые бары.
+    """
+    recent = to_msk(recent)
+    start = recent.index[0]
+    hourly = pd.concat([bars['1h'][bars['1h'].index < start], recent])
+
+    merged = {'1h': hourly}
+    for timeframe in RESAMPLE_RULES:
+        fresh = resample_bars(hourly[hourly.index >= _period_start(timeframe, start)], timeframe)
+        old = bars[timeframe]
+        merged[timeframe] = pd.concat([old[old.index < fresh.index[0]], fresh])
+    return merged
+
+
+def _trim(bars, need):
+    """Оставляет только объявленную потребителями глубину каждого ТФ"""
+    hourly = bars['1h']
+    recent_hours = int((hourly.index > hourly.index[-1] - pd.Timedelta(days=HOURLY_MIN_DAYS)).sum())
+    trimmed = {'1h': hourly.tail(max(need['1h'], recent_hours))}
+    for timeframe in RESAMPLE_RULES:
+        trimmed[timeframe] = bars[timeframe].tail(need[timeframe])
+    return trimmed
+
+
+def _refresh(ticker):
+    with _lock:
+        entry = _history.get(ticker)
+
+    need = retention()
+    last_bar = entry['bars']['1h'].index[-1] if entry is not None else None
+    # Кэш, который не склеить с часовой историей Yahoo, грузим заново
+    oldest = pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=HOURLY_MAX_DAYS - RECENT_DAYS)
+    if last_bar is None or last_bar < oldest:
+        bars = _cold_fetch(ticker, need)
+    else:
+        # Старые бары уже закрыты и не меняются - докачиваем от последнего бара в кэше
+        # (с запасом RECENT_DAYS на поправки), даже если актив давно не запрашивали
+        start = (last_bar - pd.Timedelta(days=RECENT_DAYS)).tz_convert('UTC').strftime('%Y-%m-%d')
+        recent = _download(ticker, min_bars=1, start=start)
+        bars = _merge_recent(entry['bars'], recent)
+    bars = _trim(bars, need)
+    as_of = time.time()
+    with _lock:
+        _history[ticker] = {'bars': bars, 'as_of': as_of}
+    return bars, as_of, False
+
+
+def _schedule_refresh(ticker):
+    with _lock:
+        if ticker in _refreshing:
+            return
+        _refreshing.add(ticker)
+
+    def task():
+        try:
+            _refresh(ticker)
+        except UpstreamError as e:
+            print(f"Фоновое обновление {ticker} не удалось: {e}")
+        finally:
+            with _lock:
+                _refreshing.discard(ticker)
+
+    _refresh_pool.submit(task)
+
+
+def _entry(ticker):
+    """Запись кэша в режиме stale-while-revalidate: (bars, as_of, stale)"""
+    now = time.time()
+    with _lock:
+        entry = _history.get(ticker)
+
+    if entry is not None:
+        age = now - entry['as_of']
+        if age < CACHE_FRESH_SECONDS:
+            return entry['bars'], entry['as_of'], False
+        if age < CACHE_MAX_STALENESS:
+            _schedule_refresh(ticker)
+            return entry['bars'], entry['as_of'], True
+
+    # Кэша нет или он старше допустимого - грузим синхронно
+    return _refresh(ticker)
+
+
+def get_bars(ticker):
+    """Бары актива по таймфреймам ({'1h', '4h', '1d', '1w'}, МСК) в режиме stale-while-revalidate.
+
+    Возвращает (bars, as_of, stale). Устаревшие, но не старше
+    CACHE_MAX_STALENESS данные отдаются сразу, а обновление идет в фоне.
+    """
+    bars, as_of, stale = _entry(ticker)
+    return {timeframe: df.copy() for timeframe, df in bars.items()}, as_of, stale
+
+
+def get_history(ticker, since=None):
+    """Часовые бары актива (МСК): (df, as_of, stale).
+
+    since - вернуть только бары после этого времени.
+    """
+    bars, as_of, stale = _entry(ticker)
+    df = bars['1h']
+    if since is not None:
+        df = df[df.index > since]
+    return df.copy(), as_of, stale
+
+
+def get_long_bars(ticker, need):
+    """Бары с длинной историей 4h/1d/1w для редких расчетов (матрица сигналов): (bars, as_of, stale).
+
+    need - глубина по ТФ, в retention() не входит: история грузится при первом
+    обращении и хранится только уже агрегированной, дальше продлевается свежими
+    барами основного кэша. bars['1h'] - часовой хвост основного кэша.
+    """
+    bars, as_of, stale = get_bars(ticker)
+    # Периоды с начала часового хвоста основного кэша собраны из часовых баров и
+    # учитывают поправки последних дней; более ранние там - только прогрев
+    seams = {tf: bars[tf].index[bars[tf].index >= bars['1h'].index[0]][0] for tf in RESAMPLE_RULES}
+    with _lock:
+        long = _long.get(ticker)
+
+    # Длинную историю давно не запрашивали и она не доходит до стыка - грузим заново
+    if long is None or any(long[tf].index[-1] < seams[tf] for tf in RESAMPLE_RULES):
+        fetched = _cold_fetch(ticker, {**need, '1h': 0})
+        long = {tf: fetched[tf] for tf in RESAMPLE_RULES}
+
+    merged = {'1h': bars['1h']}
+    for timeframe in RESAMPLE_RULES:
+        old, new = long[timeframe], bars[timeframe]
+        merged[timeframe] = pd.concat([old[old.index < seams[timeframe]],
+                                       new[new.index >= seams[timeframe]]]).tail(need[timeframe])
+    with _lock:
+        _long[ticker] = {tf: merged[tf] for tf in RESAMPLE_RULES}
+    return {tf: df.copy() for tf, df in merged.items()}, as_of, stale
+
+
+def lookup_derived(key, as_of):
+    """Закэшированный производный результат для данных as_of или None"""
+    with _lock:
+        cached = _derived.get(key)
+        if cached is not None and cached[0] == as_of:
+            _derived.move_to_end(key)
+            return cached[1]
+    return None
+
+
+def store_derived(key, as_of, value, nbytes=0):
+    """Сохраняет результат; nbytes - его размер в бюджете DERIVED_MAX_MB.
+
+    При превышении бюджета вытесняются давно не запрошенные результаты с размером.
+    """
+    global _derived_bytes
+    with _lock:
+        old = _derived.pop(key, None)
+        if old is not None:
+            _derived_bytes -= old[2]
+        _derived[key] = (as_of, value, nbytes)
+        _derived_bytes += nbytes
+
+        budget = DERIVED_MAX_MB * 1024 * 1024
+        for old_key in [k for k, v in _derived.items() if v[2]]:
+            if _derived_bytes <= budget or old_key == key:
+                break
+            _derived_bytes -= _derived.pop(old_key)[2]
+
+
+def get_derived(key, as_of, builder):
+    """Результат, вычисленный из данных с отметкой as_of (оценки, графики).
+
+    Пересчитывается только после обновления исходных данных.
+    """
+    with _lock:
+        cached = _derived.get(key)
+        if cached is not None and cached[0] == as_of:
+            _derived.move_to_end(key)
+            return cached[1]
+
+    value = builder()
+    store_derived(key, as_of, value)
+    return value
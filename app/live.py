@@ -0,0 +1,339 @@
+import os
+import copy
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from .utils import calc_regression, calculate_weighted_score, pivot_zone, chart_summary
+from .trend_dashboard import calculate_trend_strength
+from .cache import get_bars, get_history, format_as_of
+from .lookback import declare_lookback, ema_warmup
+
+# Клиент опрашивает /api/live с этим интервалом (секунды)
+LIVE_POLL_SECONDS = int(os.getenv("SCREENER_LIVE_POLL", "60"))
+
+REGRESSION_WINDOW = 20
+RSI_PERIOD = 14
+TREND_SPANS = (21, 55)
+PRICE_EMA_SPAN = 200
+
+# Таймфрейм -> периоды EMA, которые по нему нужны
+TIMEFRAME_SPANS = {
+    '1h': TREND_SPANS,
+    '4h': TREND_SPANS + (PRICE_EMA_SPAN,),
+    '1d': TREND_SPANS,
+    '1w': TREND_SPANS,
+}
+
+# Закрытые периоды, которые держим для регрессии (20 точек вместе с текущим) и RSI
+CLOSES_KEPT = max(REGRESSION_WINDOW - 1, RSI_PERIOD)
+
+# Стартовое состояние строится из кэша: прогрев EMA по каждому ТФ
+declare_lookback('live', {tf: ema_warmup(max(spans)) for tf, spans in TIMEFRAME_SPANS.items()})
+
+_lock = threading.Lock()
+_states = {}    # ticker -> состояние индикаторов на последнем закрытом часовом баре
+
+
+def period_keys(timeframe, times):
+    """Ключ периода для каждого бара - те же корзины, что дает resample в МСК"""
+    if timeframe == '1h':
+        return times
+    if timeframe == '4h':
+        return times.normalize() + pd.to_timedelta(times.hour // 4 * 4, unit='h')
+    if timeframe == '1d':
+        return times.normalize()
+    if timeframe == '1w':
+        # resample('W'): неделя Пн-Вс с меткой воскресенья
+        return times.normalize() + pd.to_timedelta((6 - times.weekday) % 7, unit='D')
+    raise ValueError(f"Неизвестный таймфрейм: {timeframe}")
+
+
+def _closed_bars(df, as_of):
+    """Часовые бары (МСК), закрытые на момент загрузки данных"""
+    closed = (df.index + pd.Timedelta(hours=1)) <= pd.Timestamp(as_of, unit='s', tz='UTC')
+    closed &= df['Close'].notna().to_numpy()
+    return df.loc[closed, ['Open', 'High', 'Low', 'Close']]
+
+
+def _frame_from_bars(periods, hourly, timeframe):
+    """Состояние таймфрейма по агрегированным барам из кэша.
+
+    periods - бары ТФ (последний может содержать незакрытый час),
+    hourly - закрытые часовые бары: из них собирается текущий период.
+    """
+    keys = period_keys(timeframe, hourly.index)
+    key = keys[-1]
+    current = hourly[keys == key]
+    done = periods[periods.index < key]
+    counts = pd.Series(1, index=hourly.index).groupby(keys).sum()
+
+    ema = {}
+    for span in TIMEFRAME_SPANS[timeframe]:
+        ema[span] = done['Close'].ewm(span=span, adjust=False).mean().iloc[-1] if len(done) else None
+
+    tail = done.tail(2)
+    return {
+        'key': key,
+        'high': current['High'].max(),
+        'low': current['Low'].min(),
+        'close': current['Close'].iloc[-1],
+        'bars': len(current),
+        'ema': ema,
+        'count': len(done),
+        'closes': deque(done['Close'].tail(CLOSES_KEPT), maxlen=CLOSES_KEPT),
+        # Два последних закрытых периода - для пивот-зон (нужны только дневные)
+        'done': deque(zip(tail.index, tail['High'], tail['Low'], tail['Close'],
+                          counts.reindex(tail.index, fill_value=0)), maxlen=2),
+    }
+
+
+def _push(frame, key, high, low, close):
+    """Добавляет один закрытый часовой бар: O(1) вместо пересчета всей истории"""
+    if key != frame['key']:
+        # Период закрылся: его закрытие входит в EMA и хвост для регрессии
+        for span, prev in frame['ema'].items():
+            alpha = 2.0 / (span + 1)
+            frame['ema'][span] = frame['close'] if prev is None else alpha * frame['close'] + (1 - alpha) * prev
+        frame['count'] += 1
+        frame['closes'].append(frame['close'])
+        frame['done'].append((frame['key'], frame['high'], frame['low'], frame['close'], frame['bars']))
+        frame.update(key=key, high=high, low=low, close=close, bars=1)
+    else:
+        frame['high'] = max(frame['high'], high)
+        frame['low'] = min(frame['low'], low)
+        frame['close'] = close
+        frame['bars'] += 1
+
+
+def _live_ema(frame, span):
+    """EMA с незакрытым текущим периодом, как ewm по resample с последней строкой"""
+    prev = frame['ema'][span]
+    if prev is None:
+        return frame['close']
+    alpha = 2.0 / (span + 1)
+    return alpha * frame['close'] + (1 - alpha) * prev
+
+
+def _trend(frame):
+    """Как get_trend_ema: None, пока периодов меньше 55 + 10"""
+    if frame['count'] + 1 < max(TREND_SPANS) + 10:
+        return None
+    fast, slow = _live_ema(frame, TREND_SPANS[0]), _live_ema(frame, TREND_SPANS[1])
+    if fast > slow:
+        return "bullish"
+    elif fast < slow:
+        return "bearish"
+    return "neutral"
+
+
+def _price_vs_ema(frame):
+    """Как get_price_vs_ema на 4h"""
+    if frame['count'] + 1 < PRICE_EMA_SPAN + 10:
+        return None
+    ema = _live_ema(frame, PRICE_EMA_SPAN)
+    if frame['close'] > ema:
+        return "above"
+    elif frame['close'] < ema:
+        return "below"
+    return "equal"
+
+
+def _rsi(frame):
+    """RSI 14 по дневным закрытиям, как calculate_rsi (текущий день не закрыт)"""
+    if frame['count'] + 1 < 20:
+        return None
+    closes = np.array(list(frame['closes'])[-RSI_PERIOD:] + [frame['close']])
+    delta = np.diff(closes)
+    gain = np.clip(delta, 0, None).mean()
+    loss = np.clip(-delta, 0, None).mean()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100 - 100 / (1 + gain / loss)
+    return None if np.isnan(rsi) else float(rsi)
+
+
+def _regression(frame):
+    if frame['count'] + 1 < REGRESSION_WINDOW:
+        return None
+    closes = list(frame['closes'])[-(REGRESSION_WINDOW - 1):] + [frame['close']]
+    return calc_regression(pd.Series(closes), REGRESSION_WINDOW)
+
+
+def _pivots(day):
+    """Пивот-зоны позавчера/вчера/сегодня, как calculate_pivot_zones на последнем баре"""
+    today = day['key']
+    starts = [today - pd.Timedelta(days=2), today - pd.Timedelta(days=1)]
+    done = {key: (high, low, close, bars) for key, high, low, close, bars in day['done']}
+
+    zones = []
+    for i, start in enumerate(starts):
+        if start in done:
+            high, low, close, bars = done[start]
+            zones.append(pivot_zone(start, high, low, close, True, False, i, bars))
+    zones.append(pivot_zone(today, day['high'], day['low'], day['close'], False, True, 2, day['bars']))
+    return zones
+
+
+def _bootstrap(ticker):
+    bars, as_of, stale = get_bars(ticker)
+    hourly = _closed_bars(bars['1h'], as_of)
+    if len(hourly) == 0:
+        return None
+
+    frames = {tf: _frame_from_bars(hourly if tf == '1h' else bars[tf], hourly, tf)
+              for tf in TIMEFRAME_SPANS}
+    return {
+        'frames': frames,
+        'last_bar': hourly.index[-1],
+        'as_of': as_of,
+        'stale': stale,
+    }
+
+
+def _bar_records(bars):
+    return [{'time': t.isoformat(), 'open': float(o), 'high': float(h), 'low': float(l), 'close': float(c)}
+            for t, o, h, l, c in zip(bars.index, bars['Open'], bars['High'], bars['Low'], bars['Close'])]
+
+
+def _advance(ticker):
+    """Состояние актива с учетом новых закрытых баров из кэша"""
+    with _lock:
+        state = _states.get(ticker)
+
+    if state is None:
+        state = _bootstrap(ticker)
+        if state is None:
+            return None
+        with _lock:
+            _states[ticker] = state
+        return state
+
+    df, as_of, stale = get_history(ticker, since=state['last_bar'])
+    if as_of == state['as_of']:
+        state['stale'] = stale
+        return state
+
+    bars = _closed_bars(df, as_of)
+    with _lock:
+        # Пересчитываем на копии: параллельный запрос видит либо старое, либо новое состояние
+        state = copy.deepcopy(state)
+        for tf, frame in state['frames'].items():
+            keys = period_keys(tf, bars.index)
+            for key, high, low, close in zip(keys, bars['High'], bars['Low'], bars['Close']):
+                _push(frame, key, high, low, close)
+        if len(bars):
+            state['last_bar'] = bars.index[-1]
+        state['as_of'] = as_of
+        state['stale'] = stale
+        _states[ticker] = state
+    return state
+
+
+def _pct(frames):
+    """Наклоны регрессий 1h/4h/1d в % за час, как в compute_chart_levels (None - мало данных)"""
+    regression = {tf: _regression(frames[tf]) for tf in ('1h', '4h', '1d')}
+    if any(r is None for r in regression.values()):
+        return None
+    return {
+        '1h': regression['1h'][0] / frames['1h']['close'] * 100,
+        '4h': regression['4h'][0] / frames['4h']['close'] * 100 / 4.0,
+        '1d': regression['1d'][0] / frames['1d']['close'] * 100 / 24.0,
+    }
+
+
+def _snapshot(state, name, ticker, formula_type):
+    """Оценки, пивот-зоны и ячейки дашборда по состоянию индикаторов"""
+    frames = state['frames']
+
+    trends = {f'trend_{tf}': _trend(frames[tf]) for tf in TIMEFRAME_SPANS}
+    mid_term, global_trend, strength = calculate_trend_strength(
+        trends['trend_4h'], trends['trend_1d'], trends['trend_1w'])
+
+    chart = None
+    pivot = None
+    pct = _pct(frames)
+    if pct is not None:
+        weighted_score, trend_mode, score_1d, score_4h, score_1h = calculate_weighted_score(
+            pct['1d'], pct['4h'], pct['1h'], formula_type)
+        pivots = _pivots(frames['1d'])
+        chart = chart_summary({
+            'weighted_score': weighted_score,
+            'trend_mode': trend_mode,
+            'scores': {'1d': score_1d, '4h': score_4h, '1h': score_1h},
+            'pivots': pivots
+        }, name, ticker, formula_type)
+        pivot = {level: float(pivots[-1][level]) for level in ('PP', 'R1', 'R2', 'S1', 'S2', 'M2', 'M3', 'M4', 'M5')}
+
+    return {
+        'chart': chart,
+        'pivot': pivot,
+        'trends': {
+            **trends,
+            'mid_term': mid_term,
+            'global_trend': global_trend,
+            'strength': strength,
+            'rsi_14d': _rsi(frames['1d']),
+            'price_vs_200ema_4h': _price_vs_ema(frames['4h'])
+        }
+    }
+
+
+def live_update(name, ticker, formula_type="intraday_local", since=None):
+    """Изменения по активу с момента since (время последнего бара у клиента).
+
+    Возвращает None, если новых закрытых баров нет. Индикаторы считаются
+    по закрытым барам и обновляются инкрементально, без пересчета истории.
+    Бары после since берутся из кэша; complete=False - since старше
+    часового хвоста кэша, часть баров клиенту уже не отдать.
+    """
+    state = _advance(ticker)
+    if state is None or (since is not None and state['last_bar'] <= since):
+        return None
+
+    hourly, _, _ = get_history(ticker)
+    hourly = hourly[hourly.index <= state['last_bar']]
+    if since is None:
+        new_bars = hourly.tail(1)
+    else:
+        new_bars = hourly[hourly.index > since]
+    return {
+        'ticker': ticker,
+        'name': name,
+        'last_bar': state['last_bar'].isoformat(),
+        'bars': _bar_records(new_bars),
+        'complete': since is None or since >= hourly.index[0],
+        'as_of': format_as_of(state['as_of']),
+        'stale': state['stale'],
+        **_snapshot(state, name, ticker, formula_type)
+    }
+
+
+def alert_metrics(ticker, formula_types):
+    """Значения для правил алертов на последнем закрытом баре (None - данных нет)"""
+    state = _advance(ticker)
+    if state is None:
+        return None
+
+    frames = state['frames']
+    pct = _pct(frames)
+    scores = {}
+    if pct is not None:
+        for formula_type in formula_types:
+            weighted_score, trend_mode, _, _, _ = calculate_weighted_score(
+                pct['1d'], pct['4h'], pct['1h'], formula_type)
+            scores[formula_type] = (weighted_score, trend_mode)
+
+    mid_term, _, strength = calculate_trend_strength(
+        _trend(frames['4h']), _trend(frames['1d']), _trend(frames['1w']))
+    zone = _pivots(frames['1d'])[-1]
+
+    return {
+        'last_bar': state['last_bar'],
+        'price': frames['1h']['close'],
+        'scores': scores,
+        'zone': {level: zone[level] for level in ('M2', 'PP', 'M3')},
+        'strong': mid_term if strength else None,
+        'rsi': _rsi(frames['1d'])
+    }
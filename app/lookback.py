@@ -0,0 +1,28 @@
+"""Сколько истории нужно потребителям данных.
+
+Каждый модуль, который считает что-то по барам, объявляет, сколько баров
+каждого таймфрейма ему нужно. Кэш хранит и докачивает только максимум
+по всем объявлениям, а не всю доступную историю.
+"""
+
+TIMEFRAMES = ('1h', '4h', '1d', '1w')
+
+_declared = {}      # consumer -> {timeframe: bars}
+
+
+def ema_warmup(span):
+    """Баров для EMA(adjust=False): вклад стартового значения меньше 0.3%"""
+    return span * 3 + 10
+
+
+def declare_lookback(consumer, bars):
+    """Объявить потребность потребителя: declare_lookback('chart', {'1h': 100, '1d': 20})"""
+    unknown = set(bars) - set(TIMEFRAMES)
+    if unknown:
+        raise ValueError(f"Неизвестные таймфреймы: {', '.join(sorted(unknown))}")
+    _declared[consumer] = bars
+
+
+def retention():
+    """Сколько баров каждого таймфрейма держать: максимум по всем потребителям"""
+    return {tf: max([bars.get(tf, 0) for bars in _declared.values()] or [0]) for tf in TIMEFRAMES}
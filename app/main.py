@@ -1,19 +1,30 @@
-from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request, Form, Query, HTTPException
+from fastapi.responses import HTMLResponse, Response
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
+from functools import lru_cache
 from pathlib import Path
+import asyncio
 import base64
-from io import BytesIO
+import gzip
+import pandas as pd
 from datetime import datetime
 import traceback
 
-from .utils import normalize_df, generate_chart
+from .utils import compute_chart_levels, chart_spec, chart_summary, overview_cell_spec
+from .render_pool import (render, RenderBusy, shutdown as shutdown_render_pool,
+                          IMAGE_FORMATS, DPI_PRESETS, DEFAULT_FORMAT, DEFAULT_PRESET)
 from .trend_dashboard import generate_trend_dashboard
-import yfinance as yf
-import pandas as pd
+from .signal_matrix import build_signal_matrix, recent_flips, SIGNAL_LABELS, MATRIX_LOOKBACK
+from .live import live_update, LIVE_POLL_SECONDS
+from . import alerts
+from .cache import get_bars, get_long_bars, get_derived, lookup_derived, store_derived, format_as_of, UpstreamError
 
 app = FastAPI(title="Pivot Screener")
+# Ответы с графиками (base64) и JSON сжимаются в приложении; уже сжатые middleware пропускает
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=6)
 
 BASE_DIR = Path(__file__).resolve().parent
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
@@ -44,86 +55,270 @@ FORMULA_TYPES = {
     "intraday_positional": "Intoday (positional) = 1h*0.20 + 4h*0.30 + 1d*0.50"
 }
 
-@app.get("/", response_class=HTMLResponse)
-async def index(request: Request):
-    assets_by_category = {}
-    for asset in ALL_ASSETS:
-        category = asset['category']
-        if category not in assets_by_category:
-            assets_by_category[category] = []
-        assets_by_category[category].append(asset)
+# Группировка активов для формы не меняется - считаем один раз при старте
+ASSETS_BY_CATEGORY = {}
+for asset in ALL_ASSETS:
+    category = asset['category']
+    if category not in ASSETS_BY_CATEGORY:
+        ASSETS_BY_CATEGORY[category] = []
+    ASSETS_BY_CATEGORY[category].append(asset)
+
+# Замеры полных графиков по (формат, пресет DPI), чтобы сравнивать с ними обзор
+RENDER_STATS = {}
+
+def image_payload(rendered):
+    """Изображение из пула рендера -> данные для шаблона (base64 и замеры)"""
+    return {
+        'image': base64.b64encode(rendered['data']).decode('utf-8'),
+        'mime': rendered['mime'],
+        'bytes': len(rendered['data']),
+        'build_ms': rendered['build_ms'],
+        'encode_ms': rendered['encode_ms'],
+        'render_ms': rendered['build_ms'] + rendered['encode_ms']
+    }
+
+async def render_chart(levels, asset, formula_type, image_format, dpi_preset):
+    """Рендерит график в пуле процессов и кодирует его в base64"""
+    rendered = await render("chart", chart_spec(levels, asset['name'], asset['ticker']),
+                            image_format, dpi_preset)
+    payload = image_payload(rendered)
+    record_render(image_format, dpi_preset, payload)
+    
+    return {
+        'data': chart_summary(levels, asset['name'], asset['ticker'], formula_type),
+        **payload
+    }
+
+def record_render(image_format, dpi_preset, payload):
+    stats = RENDER_STATS.setdefault((image_format, dpi_preset), {'count': 0, 'bytes': 0, 'seconds': 0.0})
+    stats['count'] += 1
+    stats['bytes'] += payload['bytes']
+    stats['seconds'] += payload['render_ms'] / 1000
+
+async def sample_full_chart(item, image_format, dpi_preset):
+    """Один полный график в том же формате и пресете, если замеров для сравнения еще нет"""
+    if (image_format, dpi_preset) in RENDER_STATS:
+        return
+    name, ticker, levels = item
+    rendered = await render("chart", chart_spec(levels, name, ticker), image_format, dpi_preset)
+    record_render(image_format, dpi_preset, image_payload(rendered))
+
+async def render_overview(items, image_format, dpi_preset):
+    """Рендерит обзорную сетку в пуле процессов и кодирует ее в base64"""
+    cells = [overview_cell_spec(levels, name, ticker) for name, ticker, levels in items]
+    rendered = await render("overview", cells, image_format, dpi_preset)
+    
+    return {
+        'count': len(items),
+        **image_payload(rendered)
+    }
+
+def image_options(image_format, dpi_preset):
+    """Формат и пресет DPI из формы с откатом на значения по умолчанию"""
+    if image_format not in IMAGE_FORMATS:
+        image_format = DEFAULT_FORMAT
+    if dpi_preset not in DPI_PRESETS['chart']:
+        dpi_preset = DEFAULT_PRESET
+    return image_format, dpi_preset
+
+async def load_levels(asset, formula_type):
+    """Данные (stale-while-revalidate) и уровни графика вне event loop"""
+    bars, as_of, stale = await run_in_threadpool(get_bars, asset['ticker'])
+    levels = await run_in_threadpool(
+        get_derived, ('levels', asset['ticker'], formula_type), as_of,
+        lambda: compute_chart_levels(bars, formula_type))
+    return levels, as_of, stale
+
+async def build_chart(asset, formula_type, image_format, dpi_preset):
+    levels, as_of, stale = await load_levels(asset, formula_type)
+    
+    key = ('chart', asset['ticker'], formula_type, image_format, dpi_preset)
+    chart = lookup_derived(key, as_of)
+    if chart is None:
+        chart = await render_chart(levels, asset, formula_type, image_format, dpi_preset)
+        store_derived(key, as_of, chart, len(chart['image']))
+    
+    return {
+        **chart,
+        'as_of': format_as_of(as_of),
+        'stale': stale
+    }
+
+def overview_report(overview, image_format, dpi_preset):
+    """Размер и время обзора против оценки для N полных графиков.
+    
+    Оценка - средний замер полного графика в том же формате и пресете DPI, умноженный на N.
+    """
+    stats = RENDER_STATS.get((image_format, dpi_preset))
+    report = {
+        'count': overview['count'],
+        'overview_kb': overview['bytes'] / 1024,
+        'overview_ms': overview['render_ms'],
+        'full_kb': None,
+        'full_ms': None,
+        'samples': 0
+    }
+    if stats:
+        report['full_kb'] = stats['bytes'] / stats['count'] * overview['count'] / 1024
+        report['full_ms'] = stats['seconds'] / stats['count'] * overview['count'] * 1000
+        report['samples'] = stats['count']
+    return report
+
+@lru_cache(maxsize=256)
+def render_control_panel(selected_assets=(), selected_formula="intraday_local",
+                         selected_image_format=DEFAULT_FORMAT, selected_dpi_preset=DEFAULT_PRESET):
+    """Форма выбора активов. Зависит только от выбора пользователя, поэтому кэшируется"""
+    return templates.get_template("_control_panel.html").render(
+        assets_by_category=ASSETS_BY_CATEGORY,
+        formula_types=FORMULA_TYPES,
+        image_formats=IMAGE_FORMATS,
+        dpi_presets=DPI_PRESETS['chart'],
+        selected_assets=selected_assets,
+        selected_formula=selected_formula,
+        selected_image_format=selected_image_format,
+        selected_dpi_preset=selected_dpi_preset
+    )
+
+def render_page(request, selected_assets, formula_type="intraday_local",
+                image_format=DEFAULT_FORMAT, dpi_preset=DEFAULT_PRESET, **context):
+    """Страница с результатами: кэшированная форма + результаты запроса"""
+    # Канонический порядок тикеров, чтобы одинаковый выбор попадал в один ключ кэша
+    selected = tuple(a['ticker'] for a in ALL_ASSETS if a['ticker'] in selected_assets)
     
     return templates.TemplateResponse("index.html", {
         "request": request,
-        "assets_by_category": assets_by_category,
+        "control_panel": render_control_panel(selected, formula_type, image_format, dpi_preset),
         "formula_types": FORMULA_TYPES,
-        "default_formula": "intraday_local"
+        "selected_formula": formula_type,
+        **context
     })
 
+@lru_cache(maxsize=1)
+def index_page():
+    """Стартовая страница без результатов: (html, gzip) - считается один раз за процесс"""
+    body = templates.get_template("index.html").render(control_panel=render_control_panel()).encode('utf-8')
+    return body, gzip.compress(body, compresslevel=9)
+
+@app.get("/", response_class=HTMLResponse)
+async def index(request: Request):
+    body, compressed = index_page()
+    headers = {"Vary": "Accept-Encoding"}
+    
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(compressed, media_type="text/html; charset=utf-8", headers=headers)
+    return HTMLResponse(body, headers=headers)
+
 @app.post("/generate", response_class=HTMLResponse)
 async def generate_charts(
     request: Request,
     selected_assets: list = Form(default=[]),
-    formula_type: str = Form(default="intraday_local")
+    formula_type: str = Form(default="intraday_local"),
+    image_format: str = Form(default=DEFAULT_FORMAT),
+    dpi_preset: str = Form(default=DEFAULT_PRESET)
 ):
     if not selected_assets:
         return await index(request)
     
     selected_assets_list = [a for a in ALL_ASSETS if a['ticker'] in selected_assets]
+    image_format, dpi_preset = image_options(image_format, dpi_preset)
     charts = []
     errors = []
     
-    for asset in selected_assets_list:
-        try:
-            df = normalize_df(yf.download(asset['ticker'], period="730d", interval="1h", progress=False))
-            
-            if len(df) < 50:
-                errors.append(f"{asset['name']} ({asset['ticker']}): insufficient data")
-                continue
-            
-            fig, chart_data = generate_chart(df, asset['name'], asset['ticker'], formula_type)
-            
-            buf = BytesIO()
-            fig.savefig(buf, format='png', dpi=120, bbox_inches='tight', facecolor='white')
-            import matplotlib.pyplot as plt
-            plt.close(fig)
-            buf.seek(0)
-            img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-            
-            charts.append({
-                'data': chart_data,
-                'image': img_base64
-            })
-            
-        except Exception as e:
-            error_detail = traceback.format_exc()
-            errors.append(f"{asset['name']} ({asset['ticker']}): {str(e)}")
+    # Последние удачные данные отдаются сразу, графики рендерятся параллельно в пуле
+    results = await asyncio.gather(
+        *(build_chart(asset, formula_type, image_format, dpi_preset) for asset in selected_assets_list),
+        return_exceptions=True
+    )
+    
+    for asset, result in zip(selected_assets_list, results):
+        if isinstance(result, (UpstreamError, RenderBusy)):
+            errors.append(f"{asset['name']} ({asset['ticker']}): {str(result)}")
+        elif isinstance(result, asyncio.CancelledError):
+            # Рендер отменен остановкой пула (например, после падения воркера)
+            errors.append(f"{asset['name']} ({asset['ticker']}): рендер отменен")
+        elif isinstance(result, BaseException):
+            error_detail = ''.join(traceback.format_exception(result))
+            errors.append(f"{asset['name']} ({asset['ticker']}): {str(result)}")
             errors.append(f"  Traceback: {error_detail[:200]}")
-            continue
+        else:
+            charts.append(result)
     
-    assets_by_category = {}
-    for asset in ALL_ASSETS:
-        category = asset['category']
-        if category not in assets_by_category:
-            assets_by_category[category] = []
-        assets_by_category[category].append(asset)
+    return render_page(
+        request, selected_assets, formula_type, image_format, dpi_preset,
+        charts=charts,
+        errors=errors,
+        generated_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    )
+
+@app.post("/generate_overview", response_class=HTMLResponse)
+async def generate_overview(
+    request: Request,
+    selected_assets: list = Form(default=[]),
+    formula_type: str = Form(default="intraday_local"),
+    image_format: str = Form(default=DEFAULT_FORMAT),
+    dpi_preset: str = Form(default=DEFAULT_PRESET)
+):
+    """Обзор всех выбранных активов одной картинкой"""
+    if not selected_assets:
+        return await index(request)
     
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "assets_by_category": assets_by_category,
-        "formula_types": FORMULA_TYPES,
-        "selected_assets": selected_assets,
-        "selected_formula": formula_type,
-        "charts": charts,
-        "errors": errors,
-        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    })
+    selected_assets_list = [a for a in ALL_ASSETS if a['ticker'] in selected_assets]
+    image_format, dpi_preset = image_options(image_format, dpi_preset)
+    items = []
+    snapshot = []
+    errors = []
+    
+    results = await asyncio.gather(
+        *(load_levels(asset, formula_type) for asset in selected_assets_list),
+        return_exceptions=True
+    )
+    
+    for asset, result in zip(selected_assets_list, results):
+        if isinstance(result, UpstreamError):
+            errors.append(f"{asset['name']} ({asset['ticker']}): {str(result)}")
+        elif isinstance(result, BaseException):
+            error_detail = ''.join(traceback.format_exception(result))
+            errors.append(f"{asset['name']} ({asset['ticker']}): {str(result)}")
+            errors.append(f"  Traceback: {error_detail[:200]}")
+        else:
+            levels, as_of, stale = result
+            items.append((asset['name'], asset['ticker'], levels))
+            snapshot.append((asset['ticker'], as_of))
+    
+    overview = None
+    overview_stats = None
+    if items:
+        key = ('overview', formula_type, image_format, dpi_preset)
+        overview = lookup_derived(key, tuple(snapshot))
+        if overview is None:
+            try:
+                overview = await render_overview(items, image_format, dpi_preset)
+                store_derived(key, tuple(snapshot), overview, len(overview['image']))
+            except RenderBusy as e:
+                errors.append(str(e))
+        if overview is not None:
+            try:
+                await sample_full_chart(items[0], image_format, dpi_preset)
+            except RenderBusy:
+                pass    # без замера - в отчете будет "нет замеров"
+            overview_stats = overview_report(overview, image_format, dpi_preset)
+    
+    return render_page(
+        request, selected_assets, formula_type, image_format, dpi_preset,
+        overview=overview,
+        overview_stats=overview_stats,
+        errors=errors,
+        generated_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    )
 
 @app.post("/generate_trends", response_class=HTMLResponse)
 async def generate_trends_dashboard(
     request: Request,
     selected_assets: list = Form(default=[]),
-    formula_type: str = Form(default="intraday_local")
+    formula_type: str = Form(default="intraday_local"),
+    image_format: str = Form(default=DEFAULT_FORMAT),
+    dpi_preset: str = Form(default=DEFAULT_PRESET)
 ):
     """Генерация дашборда трендов на основе скользящих средних"""
     
@@ -131,34 +326,128 @@ async def generate_trends_dashboard(
         return await index(request)
     
     selected_assets_list = [a for a in ALL_ASSETS if a['ticker'] in selected_assets]
+    image_format, dpi_preset = image_options(image_format, dpi_preset)
     errors = []
     
     try:
         # Генерация дашборда трендов
-        dashboard_data = generate_trend_dashboard(selected_assets_list)
+        dashboard_data = await run_in_threadpool(generate_trend_dashboard, selected_assets_list)
     except Exception as e:
         errors.append(f"Ошибка генерации дашборда: {str(e)}")
         errors.append(f"Traceback: {traceback.format_exc()[:200]}")
         dashboard_data = []
     
-    # Группируем активы по категориям для повторного отображения формы
-    assets_by_category = {}
+    return render_page(
+        request, selected_assets, formula_type, image_format, dpi_preset,
+        dashboard_data=dashboard_data,  # Передаем данные дашборда
+        errors=errors,
+        generated_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    )
+
+@app.get("/api/trend_flips")
+def trend_flips(signal: str = "strength", bars: int = 6, to: str = None):
+    """Активы, у которых сигнал дашборда сменился за последние N баров (4h).
+    
+    Обычный def: загрузка данных и расчет матрицы идут в пуле потоков, а не в event loop.
+    """
+    if signal not in SIGNAL_LABELS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный сигнал: {signal}")
+    
+    to_code = None
+    if to is not None:
+        codes = {label: code for code, label in SIGNAL_LABELS[signal].items() if label}
+        if to not in codes:
+            raise HTTPException(status_code=400, detail=f"Неизвестное состояние: {to}")
+        to_code = codes[to]
+    
+    histories = {}
+    snapshot = []
+    errors = []
     for asset in ALL_ASSETS:
-        category = asset['category']
-        if category not in assets_by_category:
-            assets_by_category[category] = []
-        assets_by_category[category].append(asset)
+        try:
+            frames, as_of, _ = get_long_bars(asset['ticker'], MATRIX_LOOKBACK)
+        except UpstreamError as e:
+            errors.append(f"{asset['name']} ({asset['ticker']}): {str(e)}")
+            continue
+        histories[asset['ticker']] = frames
+        snapshot.append((asset['ticker'], as_of))
     
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "assets_by_category": assets_by_category,
-        "formula_types": FORMULA_TYPES,
-        "selected_assets": selected_assets,
-        "selected_formula": formula_type,
-        "dashboard_data": dashboard_data,  # Передаем данные дашборда
-        "errors": errors,
-        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    })
+    if not histories:
+        return {"signal": signal, "bars": bars, "flips": [], "errors": errors}
+    
+    # Матрица пересчитывается только когда обновились данные хотя бы одного актива
+    matrix = get_derived(('signal_matrix',), tuple(snapshot), lambda: build_signal_matrix(histories))
+    names = {a['ticker']: a['name'] for a in ALL_ASSETS}
+    flips = recent_flips(matrix, signal, bars=max(bars, 1), to=to_code)
+    
+    return {
+        "signal": signal,
+        "bars": bars,
+        "last_bar": matrix['index'][-1].isoformat(),
+        "flips": [{**flip, 'name': names[flip['ticker']]} for flip in flips],
+        "errors": errors
+    }
+
+@app.get("/api/live")
+def live_updates(
+    tickers: list = Query(default=[]),
+    since: list = Query(default=[]),
+    formula_type: str = "intraday_local"
+):
+    """Новые закрытые бары и пересчитанные оценки, пивоты и тренды по активам.
+    
+    since[i] - время последнего бара, который уже есть у клиента для tickers[i];
+    активы без новых баров в ответ не попадают.
+    """
+    if formula_type not in FORMULA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Неизвестная формула: {formula_type}")
+    
+    names = {a['ticker']: a['name'] for a in ALL_ASSETS}
+    assets = []
+    errors = []
+    for i, ticker in enumerate(tickers):
+        if ticker not in names:
+            errors.append(f"{ticker}: неизвестный актив")
+            continue
+        try:
+            last_seen = pd.Timestamp(since[i]) if i < len(since) and since[i] else None
+            if last_seen is not None and last_seen.tzinfo is None:
+                last_seen = last_seen.tz_localize('UTC')    # время без пояса считаем UTC
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail=f"Некорректное время: {since[i]}")
+        try:
+            update = live_update(names[ticker], ticker, formula_type, last_seen)
+        except UpstreamError as e:
+            errors.append(f"{names[ticker]} ({ticker}): {str(e)}")
+            continue
+        if update is not None:
+            assets.append(update)
+    
+    return {"poll_seconds": LIVE_POLL_SECONDS, "assets": assets, "errors": errors}
+
+@app.get("/api/alerts")
+def recent_alerts():
+    """Последние сработавшие алерты"""
+    return {"rules": alerts.rules_count(), "alerts": alerts.recent_alerts()}
+
+@app.on_event("startup")
+def warm_index_page():
+    """Стартовая страница рендерится и сжимается до первого запроса"""
+    index_page()
+
+@app.on_event("startup")
+async def start_alerts():
+    """Фоновая проверка правил алертов (если задан SCREENER_ALERT_RULES)"""
+    alerts.start(ALL_ASSETS, FORMULA_TYPES)
+
+@app.on_event("shutdown")
+def stop_render_pool():
+    """Останавливает процессы рендера вместе с приложением"""
+    shutdown_render_pool()
+
+@app.on_event("shutdown")
+def stop_alerts():
+    alerts.stop()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from .utils import draw_chart, draw_overview
+
+# Настройки пула процессов для рендера графиков
+RENDER_WORKERS = int(os.getenv("SCREENER_RENDER_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+RENDER_RECYCLE_AFTER = int(os.getenv("SCREENER_RENDER_RECYCLE", "50"))
+RENDER_QUEUE_LIMIT = int(os.getenv("SCREENER_RENDER_QUEUE", str(RENDER_WORKERS * 8)))
+RENDER_QUEUE_TIMEOUT = float(os.getenv("SCREENER_RENDER_QUEUE_TIMEOUT", "30"))
+
+# Кодирование изображений
+# Сжатие 6 против 1: файл на ~17% меньше за +30 ms кодирования; 9 дает еще ~4% за втрое большее время
+PNG_COMPRESS_LEVEL = int(os.getenv("SCREENER_PNG_COMPRESS", "6"))
+PNG_COLORS = int(os.getenv("SCREENER_PNG_COLORS", "0"))
+WEBP_QUALITY = int(os.getenv("SCREENER_WEBP_QUALITY", "80"))
+
+IMAGE_FORMATS = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "svg": "image/svg+xml"
+}
+
+DPI_PRESETS = {
+    "chart": {"thumbnail": 60, "screen": 120, "retina": 240},
+    "overview": {"thumbnail": 60, "screen": 100, "retina": 200}
+}
+
+DEFAULT_FORMAT = "png"
+DEFAULT_PRESET = "screen"
+
+
+class RenderBusy(Exception):
+    """Очередь рендера переполнена - запрос отклонен (backpressure)"""
+
+
+_pool = None
+_slots = None
+
+
+def encode_figure(fig, fmt=DEFAULT_FORMAT, dpi=120):
+    """Кодирует фигуру в PNG, WebP или SVG"""
+    buf = BytesIO()
+    if fmt == "png" and PNG_COLORS:
+        # Палитра вместо truecolor (SCREENER_PNG_COLORS): файл в разы меньше, но с потерей цветов
+        fig.set_dpi(dpi)
+        canvas = FigureCanvasAgg(fig)
+        canvas.draw()
+        image = Image.fromarray(np.asarray(canvas.buffer_rgba())).convert('RGB')
+        image = image.quantize(PNG_COLORS, method=Image.Quantize.FASTOCTREE)
+        image.save(buf, format='png', compress_level=PNG_COMPRESS_LEVEL)
+    elif fmt == "png":
+        fig.savefig(buf, format='png', dpi=dpi, facecolor='white',
+                    pil_kwargs={'compress_level': PNG_COMPRESS_LEVEL})
+    elif fmt == "webp":
+        fig.savefig(buf, format='webp', dpi=dpi, facecolor='white',
+                    pil_kwargs={'quality': WEBP_QUALITY, 'method': 4})
+    elif fmt == "svg":
+        fig.savefig(buf, format='svg', facecolor='white')
+    else:
+        raise ValueError(f"Неизвестный формат изображения: {fmt}")
+    return buf.getvalue()
+
+
+def _render_worker(kind, spec, fmt, preset):
+    """Выполняется в процессе пула: спецификация -> изображение и замеры"""
+    started = time.perf_counter()
+    if kind == "chart":
+        fig = draw_chart(spec)
+    elif kind == "overview":
+        fig = draw_overview(spec)
+    else:
+        raise ValueError(f"Неизвестный тип графика: {kind}")
+    built = time.perf_counter()
+    data = encode_figure(fig, fmt, DPI_PRESETS[kind][preset])
+
+    return {
+        'data': data,
+        'mime': IMAGE_FORMATS[fmt],
+        'build_ms': (built - started) * 1000,
+        'encode_ms': (time.perf_counter() - built) * 1000
+    }
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        kwargs = {}
+        if sys.version_info >= (3, 11):
+            # Воркер пересоздается после N рендеров, чтобы память matplotlib не копилась
+            kwargs['max_tasks_per_child'] = RENDER_RECYCLE_AFTER
+        _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                    mp_context=multiprocessing.get_context('spawn'),
+                                    **kwargs)
+    return _pool
+
+
+def _reset_pool(pool=None):
+    """Останавливает пул; с pool - только если он еще текущий (его не пересоздал другой запрос)"""
+    global _pool
+    if _pool is not None and (pool is None or _pool is pool):
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def render(kind, spec, fmt=DEFAULT_FORMAT, preset=DEFAULT_PRESET):
+    """Рендер в пуле процессов, не блокируя event loop.
+
+    Не больше RENDER_QUEUE_LIMIT задач в работе и очереди; если место не
+    освободилось за RENDER_QUEUE_TIMEOUT секунд - RenderBusy.
+    """
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(RENDER_QUEUE_LIMIT)
+
+    try:
+        await asyncio.wait_for(_slots.acquire(), RENDER_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise RenderBusy(f"очередь рендера переполнена ({RENDER_QUEUE_LIMIT} задач)")
+
+    pool = _get_pool()
+    try:
+        return await asyncio.wrap_future(pool.submit(_render_worker, kind, spec, fmt, preset))
+    except BrokenProcessPool:
+        # Воркер упал (например, OOM) - следующий запрос получит новый пул
+        _reset_pool(pool)
+        raise
+    finally:
+        _slots.release()
+
+
+def shutdown():
+    _reset_pool()
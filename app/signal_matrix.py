@@ -0,0 +1,242 @@
+import os
+import pandas as pd
+import numpy as np
+import warnings
+warnings.filterwarnings('ignore')
+
+from .lookback import declare_lookback, ema_warmup
+
+# Коды сигналов в матрице (NaN - сигнал не определен)
+TREND_LABELS = {1: "bullish", -1: "bearish", 0: "neutral"}
+PRICE_LABELS = {1: "above", -1: "below", 0: "equal"}
+STRENGTH_LABELS = {1: "STRONG", 0: None}
+
+SIGNAL_LABELS = {
+    'trend_1h': TREND_LABELS,
+    'trend_4h': TREND_LABELS,
+    'trend_1d': TREND_LABELS,
+    'trend_1w': TREND_LABELS,
+    'mid_term': TREND_LABELS,
+    'global_trend': TREND_LABELS,
+    'strength': STRENGTH_LABELS,
+    'price_vs_200ema_4h': PRICE_LABELS,
+}
+
+FAST_PERIOD = 21
+SLOW_PERIOD = 55
+PRICE_EMA_PERIOD = 200
+RSI_PERIOD = 14
+
+# Глубина матрицы в днях: по умолчанию вся часовая история Yahoo (~730 дней)
+SIGNAL_HISTORY_DAYS = int(os.getenv("SCREENER_SIGNAL_HISTORY_DAYS", "728"))
+
+# Длинная история матрицы грузится по запросу (cache.get_long_bars) и хранится только
+# агрегированной: 4h на всю глубину, 1d/1w - с прогревом EMA до первой строки.
+# Часовой тренд нужен лишь на последних барах - хватает хвоста основного кэша
+MATRIX_LOOKBACK = {
+    '1h': ema_warmup(SLOW_PERIOD),
+    '4h': SIGNAL_HISTORY_DAYS * 6,
+    '1d': SIGNAL_HISTORY_DAYS + ema_warmup(SLOW_PERIOD),
+    '1w': SIGNAL_HISTORY_DAYS // 7 + ema_warmup(SLOW_PERIOD)
+}
+
+# В основном кэше каждого актива - только прогрев, как у дашборда трендов
+declare_lookback('signal_matrix', {
+    '1h': ema_warmup(SLOW_PERIOD),
+    '4h': ema_warmup(PRICE_EMA_PERIOD),
+    '1d': ema_warmup(SLOW_PERIOD),
+    '1w': ema_warmup(SLOW_PERIOD)
+})
+
+
+def _stack(histories, timeframe):
+    """Закрытия одного ТФ всех активов в длинный ряд (ticker, time)"""
+    return pd.concat({t: bars[timeframe]['Close'] for t, bars in histories.items()},
+                     names=['ticker', 'time']).sort_index()
+
+
+def _bar_keys(tickers, times):
+    return [pd.Index(tickers, name='ticker'), pd.Index(times, name='time')]
+
+
+def _group_ema(series, span):
+    """EMA по каждому активу отдельно (индекс: ticker, time)"""
+    return series.groupby(level='ticker').ewm(span=span, adjust=False).mean().droplevel(0)
+
+
+def _group_count(series):
+    return series.groupby(level='ticker').cumcount() + 1
+
+
+def _ema_cross(close):
+    """Код тренда 21/55 EMA на каждом баре, как в get_trend_ema"""
+    diff = _group_ema(close, FAST_PERIOD) - _group_ema(close, SLOW_PERIOD)
+    return np.sign(diff).where(_group_count(close) >= SLOW_PERIOD + 10)
+
+
+def _period_index(close_4h, period_keys):
+    """Ключ (ticker, период старшего ТФ) для каждого 4h бара"""
+    return pd.MultiIndex.from_arrays(_bar_keys(close_4h.index.get_level_values('ticker'), period_keys))
+
+
+def _live_ema(close_4h, period_close, bar_keys, span):
+    """EMA старшего ТФ на каждом 4h баре с незакрытым текущим периодом.
+
+    EMA(adjust=False) по [закрытые периоды..., текущая цена] равна
+    alpha * цена + (1 - alpha) * EMA предыдущего закрытого периода.
+    """
+    prev = _group_ema(period_close, span).groupby(level='ticker').shift(1)
+    prev = prev.reindex(bar_keys).to_numpy()
+    close = close_4h.to_numpy()
+    alpha = 2.0 / (span + 1)
+    live = np.where(np.isnan(prev), close, alpha * close + (1 - alpha) * prev)
+    return pd.Series(live, index=close_4h.index)
+
+
+def _live_trend(close_4h, period_close, period_keys):
+    bar_keys = _period_index(close_4h, period_keys)
+    fast = _live_ema(close_4h, period_close, bar_keys, FAST_PERIOD)
+    slow = _live_ema(close_4h, period_close, bar_keys, SLOW_PERIOD)
+    count = _group_count(period_close).reindex(bar_keys).to_numpy()
+    return np.sign(fast - slow).where(count >= SLOW_PERIOD + 10)
+
+
+def _live_rsi(close_4h, day_close, day_keys):
+    """RSI 14d на каждом 4h баре, текущий день - незакрытый (как calculate_rsi)"""
+    bar_keys = _period_index(close_4h, day_keys)
+    by_ticker = day_close.groupby(level='ticker')
+    delta = by_ticker.diff()
+    gain = delta.clip(lower=0).fillna(0)
+    loss = (-delta).clip(lower=0).fillna(0)
+
+    # Суммы за RSI_PERIOD - 1 закрытых дней до текущего
+    window = RSI_PERIOD - 1
+    prev_gain = gain.groupby(level='ticker').rolling(window).sum().droplevel(0)
+    prev_loss = loss.groupby(level='ticker').rolling(window).sum().droplevel(0)
+    prev_gain = prev_gain.groupby(level='ticker').shift(1).reindex(bar_keys).to_numpy()
+    prev_loss = prev_loss.groupby(level='ticker').shift(1).reindex(bar_keys).to_numpy()
+    prev_close = by_ticker.shift(1).reindex(bar_keys).to_numpy()
+
+    cur_delta = np.nan_to_num(close_4h.to_numpy() - prev_close)
+    total_gain = prev_gain + np.clip(cur_delta, 0, None)
+    total_loss = prev_loss + np.clip(-cur_delta, 0, None)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100 - 100 / (1 + total_gain / total_loss)
+
+    count = _group_count(day_close).reindex(bar_keys).to_numpy()
+    return pd.Series(np.where(count >= 20, rsi, np.nan), index=close_4h.index)
+
+
+def _align(long, tickers):
+    """Длинная таблица (ticker, time) -> массивы time x ticker.
+
+    Пока у актива нет бара (биржа закрыта), держим его последнее состояние.
+    """
+    wide = long.unstack('ticker')
+    index = wide.index
+    present = wide['close'].reindex(columns=tickers).notna().to_numpy()
+
+    rows = np.arange(len(index))[:, None]
+    last_row = np.maximum.accumulate(np.where(present, rows, -1), axis=0)
+    cols = np.arange(len(tickers))[None, :]
+
+    signals = {}
+    for name in long.columns:
+        values = wide[name].reindex(columns=tickers).to_numpy(dtype=float)
+        aligned = values[np.maximum(last_row, 0), cols]
+        signals[name] = np.where(last_row >= 0, aligned, np.nan)
+    return index, signals
+
+
+def build_signal_matrix(histories):
+    """Сигналы дашборда трендов на каждом 4h баре для всех активов сразу.
+
+    histories: {ticker: бары по таймфреймам из кэша}. Дневной и недельный ТФ
+    на каждом баре считаются так, как выглядели в тот момент (текущий период
+    не закрыт), поэтому последняя строка совпадает с analyze_asset_trends.
+    Возвращает {'index', 'tickers', 'signals': {имя: массив time x ticker}}.
+    """
+    tickers = list(histories)
+    hourly = _stack(histories, '1h')
+    close_4h = _stack(histories, '4h')
+    times_4h = close_4h.index.get_level_values('time')
+
+    # Часовой тренд на 4h баре - по последнему часу внутри бара (есть только для часового хвоста)
+    hours = hourly.index.get_level_values('time')
+    keys_4h = _bar_keys(hourly.index.get_level_values('ticker'),
+                        hours.normalize() + pd.to_timedelta(hours.hour // 4 * 4, unit='h'))
+    trend_1h = _ema_cross(hourly).groupby(keys_4h).last().reindex(close_4h.index)
+    trend_4h = _ema_cross(close_4h)
+
+    # Метки периодов как у resample: день - полночь, неделя - воскресенье
+    day_keys = times_4h.normalize()
+    week_keys = day_keys + pd.to_timedelta((6 - times_4h.weekday) % 7, unit='D')
+    day_close = _stack(histories, '1d')
+    trend_1d = _live_trend(close_4h, day_close, day_keys)
+    trend_1w = _live_trend(close_4h, _stack(histories, '1w'), week_keys)
+
+    # MidTerm (4h+1d), Global (1d+1w), STRONG - как в calculate_trend_strength
+    mid_term = trend_4h.where(trend_4h == trend_1d)
+    global_trend = trend_1d.where(trend_1d == trend_1w)
+    strength = (mid_term == global_trend).astype(float)
+
+    ema_200 = _group_ema(close_4h, PRICE_EMA_PERIOD)
+    price_vs_ema = np.sign(close_4h - ema_200).where(_group_count(close_4h) >= PRICE_EMA_PERIOD + 10)
+
+    long = pd.DataFrame({
+        'close': close_4h,
+        'trend_1h': trend_1h,
+        'trend_4h': trend_4h,
+        'trend_1d': trend_1d,
+        'trend_1w': trend_1w,
+        'mid_term': mid_term,
+        'global_trend': global_trend,
+        'strength': strength,
+        'rsi_14d': _live_rsi(close_4h, day_close, day_keys),
+        'price_vs_200ema_4h': price_vs_ema,
+    })
+
+    index, signals = _align(long, tickers)
+    return {'index': index, 'tickers': tickers, 'signals': signals}
+
+
+def recent_flips(matrix, signal, bars=6, to=None):
+    """Активы, у которых сигнал сменился за последние `bars` баров.
+
+    to - код нового состояния (например 1 для STRONG/bullish), None - любой.
+    """
+    values = matrix['signals'][signal]
+    if len(values) < 2:
+        return []
+    # Смена - только между двумя определенными состояниями: прогрев EMA (NaN -> значение) не flip
+    changed = (values[1:] != values[:-1]) & ~np.isnan(values[1:]) & ~np.isnan(values[:-1])
+    window = changed[-bars:]
+
+    # Последняя смена в окне: состояние после нее держится до последнего бара
+    flipped = window.any(axis=0)
+    if to is not None:
+        flipped &= values[-1] == to
+    last_flip = len(window) - 1 - np.argmax(window[::-1], axis=0)
+
+    labels = SIGNAL_LABELS.get(signal)
+    start = len(values) - 1 - len(window)
+    flips = []
+    for col in np.flatnonzero(flipped):
+        row = start + last_flip[col]
+        prev_value, new_value = values[row, col], values[row + 1, col]
+        flips.append({
+            'ticker': matrix['tickers'][col],
+            'time': matrix['index'][row + 1].isoformat(),
+            'bars_ago': int(len(values) - 2 - row),
+            'from': _label(labels, prev_value),
+            'to': _label(labels, new_value),
+        })
+    return flips
+
+
+def _label(labels, value):
+    if np.isnan(value):
+        return None
+    if labels is None:
+        return float(value)
+    return labels.get(int(value))
@@ -208,4 +208,171 @@ document.addEventListener('DOMContentLoaded', function() {
         });
         document.querySelector('.control-panel').appendChild(clearBtn);
     }
+
+    // Live-режим: опрос /api/live, карточки и дашборд обновляются на месте без перезагрузки
+    const liveToggle = document.getElementById('live-mode');
+    if (liveToggle) {
+        const liveStatus = document.getElementById('live-status');
+        const lastBars = {};  // ticker -> время последнего закрытого бара, который уже показан
+        let liveTimer = null;
+        
+        const capitalize = text => text.charAt(0).toUpperCase() + text.slice(1);
+        const formatBar = iso => iso.slice(0, 16).replace('T', ' ');
+        
+        function flash(el) {
+            el.classList.remove('live-updated');
+            void el.offsetWidth;  // перезапуск анимации
+            el.classList.add('live-updated');
+        }
+        
+        function setText(el, text) {
+            if (el && el.textContent.trim() !== text) {
+                el.textContent = text;
+                flash(el);
+            }
+        }
+        
+        // Та же разметка ячейки, что в index.html
+        function signalCell(name, value) {
+            const none = '<span class="trend-none">-</span>';
+            if (name.startsWith('trend_')) {
+                if (value === 'bullish') return ['trend-bullish', '<span class="arrow-up">↑</span>'];
+                if (value === 'bearish') return ['trend-bearish', '<span class="arrow-down">↓</span>'];
+                return ['trend-neutral', '<span class="arrow-neutral">→</span>'];
+            }
+            if (name === 'mid_term' || name === 'global_trend') {
+                const cls = value === 'bullish' ? 'trend-bullish' : value === 'bearish' ? 'trend-bearish' : '';
+                return [cls, value ? `<span class="trend-label">${capitalize(value)}</span>` : none];
+            }
+            if (name === 'strength') {
+                return [value === 'STRONG' ? 'trend-strong' : '', value ? `<span class="strength-badge">${value}</span>` : none];
+            }
+            if (name === 'rsi_14d') {
+                const cls = value !== null && value > 70 ? 'rsi-overbought' : value !== null && value < 30 ? 'rsi-oversold' : '';
+                return [cls, value !== null ? `<span class="rsi-value">${value.toFixed(1)}</span>` : none];
+            }
+            if (name === 'price_vs_200ema_4h') {
+                const cls = value === 'above' ? 'price-above' : value === 'below' ? 'price-below' : '';
+                return [cls, cls ? `<span class="price-label">${capitalize(value)}</span>` : none];
+            }
+            return ['', none];
+        }
+        
+        function patchTrends(row, trends) {
+            row.className = trends.trend_1d === 'bullish' ? 'bullish-row' : trends.trend_1d === 'bearish' ? 'bearish-row' : '';
+            row.querySelectorAll('[data-signal]').forEach(cell => {
+                const value = trends[cell.dataset.signal];
+                const key = JSON.stringify(value);
+                if (cell.dataset.value === key) return;
+                
+                const [cls, html] = signalCell(cell.dataset.signal, value);
+                cell.className = cls;
+                cell.innerHTML = html;
+                // Первая синхронизация не подсвечивается - подсвечиваем только изменения
+                if (cell.dataset.value !== undefined) flash(cell);
+                cell.dataset.value = key;
+            });
+        }
+        
+        function patchChart(card, chart) {
+            if (!chart) return;
+            const badge = card.querySelector('.score-badge');
+            badge.classList.toggle('bullish', chart.trend_mode === 'bullish');
+            badge.classList.toggle('bearish', chart.trend_mode !== 'bullish');
+            setText(badge.querySelector('.score-value'), chart.weighted_score.toFixed(2));
+            setText(badge.querySelector('.score-label'), capitalize(chart.trend_mode));
+            
+            card.querySelectorAll('[data-score]').forEach(el => {
+                const score = chart.scores[el.dataset.score];
+                el.className = `detail-value score-${score}`;
+                setText(el, `${score}/5`);
+            });
+            
+            const trade = card.querySelector('.stop-loss-info');
+            trade.hidden = chart.stop_loss === undefined;
+            if (!trade.hidden) {
+                ['entry_mid', 'stop_loss', 'target'].forEach(field => {
+                    setText(trade.querySelector(`[data-field="${field}"]`), chart[field].toFixed(2));
+                });
+                setText(trade.querySelector('[data-field="rr_ratio"]'), `1:${chart.rr_ratio.toFixed(2)}`);
+            }
+        }
+        
+        function patchLevels(card, pivot, bar) {
+            const row = card.querySelector('.live-levels');
+            if (!row || !pivot) return;
+            row.hidden = false;
+            row.querySelectorAll('[data-pivot]').forEach(el => {
+                setText(el, pivot[el.dataset.pivot].toFixed(2));
+            });
+            if (bar) {
+                setText(row.querySelector('[data-field="last_bar"]'),
+                    [bar.open, bar.high, bar.low, bar.close].map(value => value.toFixed(2)).join(' / '));
+            }
+        }
+        
+        function applyUpdate(update) {
+            lastBars[update.ticker] = update.last_bar;
+            document.querySelectorAll(`[data-ticker="${CSS.escape(update.ticker)}"]`).forEach(el => {
+                const liveBar = el.querySelector('.live-bar');
+                if (liveBar) {
+                    liveBar.hidden = false;
+                    const note = el.classList.contains('chart-card') ? ' · картинка на момент генерации, уровни ниже - текущие' : '';
+                    const gap = update.complete ? '' : ' · часть баров пропущена, обновите страницу';
+                    liveBar.textContent = `Бар ${formatBar(update.last_bar)} (+${update.bars.length})${gap}${note}`;
+                }
+                if (el.classList.contains('chart-card')) {
+                    patchChart(el, update.chart);
+                    patchLevels(el, update.pivot, update.bars[update.bars.length - 1]);
+                } else {
+                    patchTrends(el, update.trends);
+                }
+            });
+        }
+        
+        async function pollLive() {
+            const tickers = new Set();
+            document.querySelectorAll('.chart-card[data-ticker], tr[data-ticker]').forEach(el => tickers.add(el.dataset.ticker));
+            
+            const params = new URLSearchParams({ formula_type: liveToggle.dataset.formula });
+            tickers.forEach(ticker => {
+                params.append('tickers', ticker);
+                params.append('since', lastBars[ticker] || '');
+            });
+            
+            let pollSeconds = 60;
+            try {
+                const response = await fetch(`/api/live?${params}`);
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                const data = await response.json();
+                pollSeconds = data.poll_seconds;
+                data.assets.forEach(applyUpdate);
+                liveStatus.textContent = `· проверено ${new Date().toLocaleTimeString()}` +
+                    (data.errors.length ? ` · ошибок: ${data.errors.length}` : '');
+            } catch (err) {
+                liveStatus.textContent = `· ошибка: ${err.message}`;
+            }
+            
+            clearTimeout(liveTimer);
+            if (liveToggle.checked) {
+                liveTimer = setTimeout(pollLive, pollSeconds * 1000);
+            }
+        }
+        
+        liveToggle.checked = localStorage.getItem('live_mode') === 'true';
+        liveToggle.addEventListener('change', function() {
+            localStorage.setItem('live_mode', this.checked);
+            clearTimeout(liveTimer);
+            if (this.checked) {
+                pollLive();
+            } else {
+                liveStatus.textContent = '';
+            }
+        });
+        if (liveToggle.checked) {
+            pollLive();
+        }
+    }
 });
\ No newline at end of file
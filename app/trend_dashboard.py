@@ -1,13 +1,19 @@
-import yfinance as yf
 import pandas as pd
 import numpy as np
 import warnings
 warnings.filterwarnings('ignore')
 
-def normalize_df(df):
-    if isinstance(df.columns, pd.MultiIndex):
-        df.columns = [col[0] for col in df.columns]
-    return df
+from .cache import get_bars, get_derived, format_as_of
+from .lookback import declare_lookback, ema_warmup
+
+# Тренды 21/55 EMA на всех ТФ, 200 EMA на 4h; RSI 14d укладывается в дневную историю
+TRENDS_LOOKBACK = {
+    '1h': ema_warmup(55),
+    '4h': ema_warmup(200),
+    '1d': ema_warmup(55),
+    '1w': ema_warmup(55)
+}
+declare_lookback('trends', TRENDS_LOOKBACK)
 
 def calculate_ema(series, period):
     """Расчет экспоненциальной скользящей средней"""
@@ -83,79 +89,57 @@ def calculate_trend_strength(hourly_trend, daily_trend, weekly_trend):
     
     return mid_term, global_trend, strength
 
+def compute_asset_trends(name, ticker, bars):
+    """Считает тренды по уже агрегированным барам (МСК) из кэша"""
+    df_1h, df_4h, df_1d, df_1w = bars['1h'], bars['4h'], bars['1d'], bars['1w']
+    if len(df_1h) < 100:
+        return None
+    
+    # Расчет трендов на основе 21/55 EMA
+    trend_1h = get_trend_ema(df_1h, 21, 55)
+    trend_4h = get_trend_ema(df_4h, 21, 55)
+    trend_1d = get_trend_ema(df_1d, 21, 55)
+    trend_1w = get_trend_ema(df_1w, 21, 55)
+    
+    # Расчет силы тренда
+    mid_term, global_trend, strength = calculate_trend_strength(trend_4h, trend_1d, trend_1w)
+    
+    # RSI 14d
+    rsi_14d = None
+    if len(df_1d) >= 20:
+        rsi_series = calculate_rsi(df_1d['Close'], 14)
+        if len(rsi_series.dropna()) > 0:
+            rsi_14d = rsi_series.iloc[-1]
+    
+    # Цена относительно 200 EMA на 4h
+    price_vs_200ema_4h = get_price_vs_ema(df_4h, 200)
+    
+    return {
+        'name': name,
+        'ticker': ticker,
+        'trend_1h': trend_1h,
+        'trend_4h': trend_4h,
+        'trend_1d': trend_1d,
+        'trend_1w': trend_1w,
+        'mid_term': mid_term,
+        'global_trend': global_trend,
+        'strength': strength,
+        'rsi_14d': rsi_14d,
+        'price_vs_200ema_4h': price_vs_200ema_4h
+    }
+
 def analyze_asset_trends(name, ticker):
     """Анализирует тренды для одного актива на всех таймфреймах"""
     try:
-        # Загрузка данных
-        df_1h = normalize_df(yf.download(ticker, period="730d", interval="1h", progress=False))
+        # Данные из кэша (stale-while-revalidate), пересчет только при обновлении
+        bars, as_of, stale = get_bars(ticker)
+        trend_data = get_derived(('trends', ticker), as_of,
+                                 lambda: compute_asset_trends(name, ticker, bars))
         
-        if len(df_1h) < 100:
+        if trend_data is None:
             return None
         
-        # Конвертация в МСК
-        if df_1h.index.tz is None:
-            df_1h.index = df_1h.index.tz_localize('UTC')
-        df_1h.index = df_1h.index.tz_convert('Europe/Moscow')
-        
-        # Агрегация в 4h
-        df_4h = df_1h.resample('4h').agg({
-            'Open': 'first',
-            'High': 'max',
-            'Low': 'min',
-            'Close': 'last',
-            'Volume': 'sum'
-        }).dropna()
-        
-        # Агрегация в 1d
-        df_1d = df_1h.resample('D').agg({
-            'Open': 'first',
-            'High': 'max',
-            'Low': 'min',
-            'Close': 'last',
-            'Volume': 'sum'
-        }).dropna()
-        
-        # Агрегация в 1w
-        df_1w = df_1h.resample('W').agg({
-            'Open': 'first',
-            'High': 'max',
-            'Low': 'min',
-            'Close': 'last',
-            'Volume': 'sum'
-        }).dropna()
-        
-        # Расчет трендов на основе 21/55 EMA
-        trend_1h = get_trend_ema(df_1h, 21, 55)
-        trend_4h = get_trend_ema(df_4h, 21, 55)
-        trend_1d = get_trend_ema(df_1d, 21, 55)
-        trend_1w = get_trend_ema(df_1w, 21, 55)
-        
-        # Расчет силы тренда
-        mid_term, global_trend, strength = calculate_trend_strength(trend_4h, trend_1d, trend_1w)
-        
-        # RSI 14d
-        rsi_14d = None
-        if len(df_1d) >= 20:
-            rsi_series = calculate_rsi(df_1d['Close'], 14)
-            if len(rsi_series.dropna()) > 0:
-                rsi_14d = rsi_series.iloc[-1]
-        
-        # Цена относительно 200 EMA на 4h
-        price_vs_200ema_4h = get_price_vs_ema(df_4h, 200)
-        
-        return {
-            'name': name,
-            'ticker': ticker,
-            'trend_1h': trend_1h,
-            'trend_4h': trend_4h,
-            'trend_1d': trend_1d,
-            'trend_1w': trend_1w,
-            'mid_term': mid_term,
-            'global_trend': global_trend,
-            'strength': strength,
-            'rsi_14d': rsi_14d,
-            'price_vs_200ema_4h': price_vs_200ema_4h
-        }
+        return {**trend_data, 'as_of': format_as_of(as_of), 'stale': stale}
         
     except Exception as e:
         print(f"Ошибка при анализе {name} ({ticker}): {str(e)}")
@@ -1,6 +1,6 @@
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import yfinance as yf
 import pandas as pd
 import numpy as np
@@ -8,11 +8,49 @@ from matplotlib.patches import Rectangle
 import warnings
 warnings.filterwarnings('ignore')
 
+from .lookback import declare_lookback
+
 def normalize_df(df):
     if isinstance(df.columns, pd.MultiIndex):
         df.columns = [col[0] for col in df.columns]
     return df
 
+OHLCV_AGG = {
+    'Open': 'first',
+    'High': 'max',
+    'Low': 'min',
+    'Close': 'last',
+    'Volume': 'sum'
+}
+
+# Старшие таймфреймы строятся из часовых баров в МСК
+RESAMPLE_RULES = {'4h': '4h', '1d': 'D', '1w': 'W'}
+
+# Графику нужно окно отрисовки (100 часовых баров) и 20 точек регрессии на 4h/1d
+CHART_LOOKBACK = {'1h': 100, '4h': 20, '1d': 20}
+declare_lookback('chart', CHART_LOOKBACK)
+
+def to_msk(df):
+    """Индекс баров -> Europe/Moscow (наивное время считается UTC)"""
+    if not isinstance(df.index, pd.DatetimeIndex):
+        df.index = pd.to_datetime(df.index)
+    
+    if df.index.tz is None:
+        df.index = df.index.tz_localize('UTC')
+    df.index = df.index.tz_convert('Europe/Moscow')
+    return df
+
+def resample_bars(df, timeframe):
+    return df.resample(RESAMPLE_RULES[timeframe]).agg(OHLCV_AGG).dropna()
+
+def aggregate_bars(df_1h):
+    """Часовые бары -> {'1h', '4h', '1d', '1w'} в МСК"""
+    df_1h = to_msk(df_1h)
+    bars = {'1h': df_1h}
+    for timeframe in RESAMPLE_RULES:
+        bars[timeframe] = resample_bars(df_1h, timeframe)
+    return bars
+
 def calc_regression(series, window=20):
     y = series.tail(window).values
     x = np.arange(window)
@@ -45,6 +83,56 @@ def calculate_weighted_score(pct_1d, pct_4h, pct_1h, formula_type="intraday_loca
     trend_mode = "bullish" if weighted_score > 3.0 else "bearish"
     return weighted_score, trend_mode, score_1d, score_4h, score_1h
 
+def pivot_zone(period_start, period_high, period_low, period_close,
+               is_completed, future, zone_index, bars_count):
+    """Уровни одной пивот-зоны по high/low/close дневного периода"""
+    PP = (period_high + period_low + period_close) / 3.0
+    R1 = 2 * PP - period_low
+    R2 = PP + (period_high - period_low)
+    S1 = 2 * PP - period_high
+    S2 = PP - (period_high - period_low)
+    M2 = 0.5 * (PP + S1)
+    M3 = 0.5 * (PP + R1)
+    M4 = 0.5 * (R1 + R2)
+    M5 = 0.5 * (S1 + S2)
+    
+    if future:
+        zone_mid_bull = (PP + M2) / 2
+        risk_distance_bull = M4 - zone_mid_bull
+        stop_loss_bull = zone_mid_bull - (risk_distance_bull / 2)
+        zone_mid_bear = (PP + M3) / 2
+        risk_distance_bear = zone_mid_bear - M5
+        stop_loss_bear = zone_mid_bear + (risk_distance_bear / 2)
+        risk_reward_ratio = 2.0
+    else:
+        stop_loss_bull = None
+        stop_loss_bear = None
+        risk_reward_ratio = None
+    
+    return {
+        'start_time': period_start,
+        'end_time': period_start + pd.Timedelta(days=1),
+        'PP': PP,
+        'R1': R1,
+        'R2': R2,
+        'S1': S1,
+        'S2': S2,
+        'M2': M2,
+        'M3': M3,
+        'M4': M4,
+        'M5': M5,
+        'period_high': period_high,
+        'period_low': period_low,
+        'period_close': period_close,
+        'is_completed': is_completed,
+        'future': future,
+        'zone_index': zone_index,
+        'bars_count': bars_count,
+        'stop_loss_bull': stop_loss_bull,
+        'stop_loss_bear': stop_loss_bear,
+        'risk_reward_ratio': risk_reward_ratio
+    }
+
 def calculate_pivot_zones(df_1h, current_idx, num_zones=3):
     zones = []
     today = df_1h.index[current_idx].normalize()
@@ -69,78 +157,17 @@ def calculate_pivot_zones(df_1h, current_idx, num_zones=3):
             period_close = df_1h['Close'].iloc[current_idx]
             future = True
         
-        PP = (period_high + period_low + period_close) / 3.0
-        R1 = 2 * PP - period_low
-        R2 = PP + (period_high - period_low)
-        S1 = 2 * PP - period_high
-        S2 = PP - (period_high - period_low)
-        M2 = 0.5 * (PP + S1)
-        M3 = 0.5 * (PP + R1)
-        M4 = 0.5 * (R1 + R2)
-        M5 = 0.5 * (S1 + S2)
-        
-        if future:
-            zone_mid_bull = (PP + M2) / 2
-            risk_distance_bull = M4 - zone_mid_bull
-            stop_loss_bull = zone_mid_bull - (risk_distance_bull / 2)
-            zone_mid_bear = (PP + M3) / 2
-            risk_distance_bear = zone_mid_bear - M5
-            stop_loss_bear = zone_mid_bear + (risk_distance_bear / 2)
-            risk_reward_ratio = 2.0
-        else:
-            stop_loss_bull = None
-            stop_loss_bear = None
-            risk_reward_ratio = None
-        
-        zones.append({
-            'start_time': period_start,
-            'end_time': period_start + pd.Timedelta(days=1),
-            'PP': PP,
-            'R1': R1,
-            'R2': R2,
-            'S1': S1,
-            'S2': S2,
-            'M2': M2,
-            'M3': M3,
-            'M4': M4,
-            'M5': M5,
-            'period_high': period_high,
-            'period_low': period_low,
-            'period_close': period_close,
-            'is_completed': is_completed,
-            'future': future,
-            'zone_index': i,
-            'bars_count': len(df_period),
-            'stop_loss_bull': stop_loss_bull,
-            'stop_loss_bear': stop_loss_bear,
-            'risk_reward_ratio': risk_reward_ratio
-        })
+        zones.append(pivot_zone(period_start, period_high, period_low, period_close,
+                                is_completed, future, i, len(df_period)))
     
     return zones
 
-def generate_chart(df_1h, name, ticker, formula_type="intraday_local"):
-    if not isinstance(df_1h.index, pd.DatetimeIndex):
-        df_1h.index = pd.to_datetime(df_1h.index)
-    
-    if df_1h.index.tz is None:
-        df_1h.index = df_1h.index.tz_localize('UTC')
-    df_1h.index = df_1h.index.tz_convert('Europe/Moscow')
-    
-    df_4h = df_1h.resample('4h').agg({
-        'Open': 'first',
-        'High': 'max',
-        'Low': 'min',
-        'Close': 'last',
-        'Volume': 'sum'
-    }).dropna()
-    
-    df_1d = df_1h.resample('D').agg({
-        'Open': 'first',
-        'High': 'max',
-        'Low': 'min',
-        'Close': 'last',
-        'Volume': 'sum'
-    }).dropna()
+def compute_chart_levels(bars, formula_type="intraday_local"):
+    """Расчет всего, что нужно для графика: регрессии, оценки, пивоты.
+    
+    bars - бары по таймфреймам из кэша (см. aggregate_bars).
+    """
+    df_1h, df_4h, df_1d = bars['1h'], bars['4h'], bars['1d']
     
     slope_1h, lower_1h, mid_1h, upper_1h = calc_regression(df_1h['Close'])
     slope_4h, lower_4h, mid_4h, upper_4h = calc_regression(df_4h['Close'])
@@ -155,6 +182,58 @@ def generate_chart(df_1h, name, ticker, formula_type="intraday_local"):
         pct_1d, pct_4h, pct_1h, formula_type
     )
     
+    pivots = calculate_pivot_zones(df_1h, len(df_1h)-1, num_zones=3)
+    
+    return {
+        'df_1h': df_1h,
+        'df_4h': df_4h,
+        'df_1d': df_1d,
+        'regression': {
+            '1h': (lower_1h, mid_1h, upper_1h),
+            '4h': (lower_4h, mid_4h, upper_4h),
+            '1d': (lower_1d, mid_1d, upper_1d)
+        },
+        'pct': {'1d': pct_1d, '4h': pct_4h, '1h': pct_1h},
+        'weighted_score': weighted_score,
+        'trend_mode': trend_mode,
+        'scores': {'1d': score_1d, '4h': score_4h, '1h': score_1h},
+        'pivots': pivots
+    }
+
+def chart_spec(levels, name, ticker, plot_window=100):
+    """Минимальные данные для отрисовки графика: бары окна и рассчитанные уровни.
+    
+    Спецификация сериализуемая, ее можно передать в процесс рендера.
+    """
+    return {
+        'name': name,
+        'ticker': ticker,
+        'bars': levels['df_1h'][['Open', 'High', 'Low', 'Close']].tail(plot_window),
+        'plot_window': plot_window,
+        'regression': levels['regression'],
+        'has_regression': {
+            '1h': len(levels['df_1h']) >= 20,
+            '4h': len(levels['df_4h']) >= 20,
+            '1d': len(levels['df_1d']) >= 20
+        },
+        'pct': levels['pct'],
+        'weighted_score': levels['weighted_score'],
+        'trend_mode': levels['trend_mode'],
+        'scores': levels['scores'],
+        'pivots': levels['pivots']
+    }
+
+def draw_chart(spec):
+    """Рисует полный график по спецификации (без pyplot, безопасно в воркерах)"""
+    lower_1h, mid_1h, upper_1h = spec['regression']['1h']
+    lower_4h, mid_4h, upper_4h = spec['regression']['4h']
+    lower_1d, mid_1d, upper_1d = spec['regression']['1d']
+    pct_1d, pct_4h, pct_1h = spec['pct']['1d'], spec['pct']['4h'], spec['pct']['1h']
+    weighted_score, trend_mode = spec['weighted_score'], spec['trend_mode']
+    score_1d, score_4h, score_1h = spec['scores']['1d'], spec['scores']['4h'], spec['scores']['1h']
+    pivots = spec['pivots']
+    name, ticker = spec['name'], spec['ticker']
+    
     if trend_mode == "bullish":
         cat_1d, col_1d, _ = classify_trend(pct_1d)
         cat_4h, col_4h, _ = classify_trend(pct_4h)
@@ -174,12 +253,13 @@ def generate_chart(df_1h, name, ticker, formula_type="intraday_local"):
         stop_color = '#D32F2F'
         zone_label = "Sell Zone"
     
-    plot_window = 100
+    plot_window = spec['plot_window']
     future_hours = 30
     total_width = plot_window + future_hours + 8
-    df_plot = df_1h.tail(plot_window).copy()
+    df_plot = spec['bars']
     
-    fig, ax = plt.subplots(figsize=(22, 10), facecolor='white')
+    fig = Figure(figsize=(22, 10), facecolor='white')
+    ax = fig.subplots()
     ax.set_facecolor('#F8F9FA')
     
     for i, (_, row) in enumerate(df_plot.iterrows()):
@@ -189,9 +269,7 @@ def generate_chart(df_1h, name, ticker, formula_type="intraday_local"):
         ax.plot([i,i], [h, max(o,c)], color='black', linewidth=1)
         ax.plot([i,i], [min(o,c), l], color='black', linewidth=1)
     
-    pivots = calculate_pivot_zones(df_1h, len(df_1h)-1, num_zones=3)
-    
-    if len(df_1d) >= 20:
+    if spec['has_regression']['1d']:
         x = np.linspace(max(0, plot_window-96), plot_window, 5)
         y_mid = np.linspace(mid_1d[-4], mid_1d[-1], 5)
         y_up = np.linspace(upper_1d[-4], upper_1d[-1], 5)
@@ -199,7 +277,7 @@ def generate_chart(df_1h, name, ticker, formula_type="intraday_local"):
         ax.plot(x, y_mid, color=col_1d, linewidth=2.8, alpha=0.9)
         ax.fill_between(x, y_low, y_up, color=col_1d, alpha=0.08)
     
-    if len(df_4h) >= 20:
+    if spec['has_regression']['4h']:
         x = np.linspace(max(0, plot_window-80), plot_window, 21)
         y_mid = np.interp(x, np.linspace(max(0, plot_window-80), plot_window, 20), mid_4h[-20:])
         y_up = np.interp(x, np.linspace(max(0, plot_window-80), plot_window, 20), upper_4h[-20:])
@@ -207,7 +285,7 @@ def generate_chart(df_1h, name, ticker, formula_type="intraday_local"):
         ax.plot(x, y_mid, color=col_4h, linewidth=2.6, alpha=0.95)
         ax.fill_between(x, y_low, y_up, color=col_4h, alpha=0.12)
     
-    if len(df_1h) >= 20:
+    if spec['has_regression']['1h']:
         x = np.arange(plot_window-20, plot_window)
         ax.plot(x, mid_1h[-20:], color=col_1h, linewidth=3.2, alpha=1.0, marker='o', markersize=4)
         ax.fill_between(x, lower_1h[-20:], upper_1h[-20:], color=col_1h, alpha=0.20)
@@ -364,7 +442,16 @@ WEIGHTED:      {weighted_score:.2f} ({trend_mode.capitalize()})"""
     ax.text(0.98, 0.02, period, transform=ax.transAxes, fontsize=9.5, color='gray', ha='right', 
             style='italic', alpha=0.85)
     
-    plt.tight_layout()
+    # Фиксированные поля вместо tight_layout/bbox_inches='tight': без лишнего прохода отрисовки
+    fig.subplots_adjust(left=0.045, right=0.985, top=0.92, bottom=0.12)
+    
+    return fig
+
+def chart_summary(levels, name, ticker, formula_type="intraday_local"):
+    """Данные карточки графика: оценки и параметры сделки по прогнозной зоне"""
+    weighted_score, trend_mode = levels['weighted_score'], levels['trend_mode']
+    score_1d, score_4h, score_1h = levels['scores']['1d'], levels['scores']['4h'], levels['scores']['1h']
+    pivots = levels['pivots']
     
     chart_data = {
         'name': name,
@@ -398,4 +485,94 @@ WEIGHTED:      {weighted_score:.2f} ({trend_mode.capitalize()})"""
             chart_data['target'] = target
             chart_data['rr_ratio'] = 2.00
     
-    return fig, chart_data
\ No newline at end of file
+    return chart_data
+
+def generate_chart(df_1h, name, ticker, formula_type="intraday_local"):
+    levels = compute_chart_levels(aggregate_bars(df_1h), formula_type)
+    fig = draw_chart(chart_spec(levels, name, ticker))
+    return fig, chart_summary(levels, name, ticker, formula_type)
+
+OVERVIEW_BARS = 30
+OVERVIEW_COLS = 4
+OVERVIEW_STYLE = {
+    'font.size': 7,
+    'axes.titlesize': 8.5,
+    'axes.titleweight': 'bold',
+    'axes.edgecolor': '#CFD8DC',
+    'axes.facecolor': '#F8F9FA',
+    'axes.linewidth': 0.6,
+    'xtick.major.size': 0,
+    'ytick.major.size': 2,
+    'ytick.labelsize': 6.5,
+}
+
+def overview_cell_spec(levels, name, ticker):
+    """Данные одной ячейки обзора: прореженные 4h бары и уровни"""
+    pivots = levels['pivots']
+    return {
+        'name': name,
+        'ticker': ticker,
+        'bars': levels['df_4h'][['Open', 'High', 'Low', 'Close']].tail(OVERVIEW_BARS),
+        'regression': levels['regression']['4h'],
+        'pct': levels['pct'],
+        'weighted_score': levels['weighted_score'],
+        'trend_mode': levels['trend_mode'],
+        'pivots': pivots[-1:] if pivots and pivots[-1]['future'] else []
+    }
+
+def _draw_overview_cell(ax, cell):
+    """Одна ячейка обзора: 4h свечи, 4h регрессия и текущая (прогнозная) пивот-зона"""
+    bars = cell['bars']
+    o, h, l, c = (bars[col].to_numpy() for col in ('Open', 'High', 'Low', 'Close'))
+    x = np.arange(len(bars))
+    colors = np.where(c >= o, '#26A69A', '#EF5350')
+    
+    # Одним вызовом на все свечи вместо bar/plot на каждый бар
+    ax.vlines(x, l, h, color='#455A64', linewidth=0.6)
+    ax.bar(x, np.abs(c - o), bottom=np.minimum(o, c), width=0.7, color=colors, linewidth=0)
+    
+    lower, mid, upper = cell['regression']
+    band_len = min(len(mid), len(bars))
+    band_x = x[-band_len:]
+    _, band_color, _ = classify_trend(cell['pct']['4h'])
+    ax.plot(band_x, mid[-band_len:], color=band_color, linewidth=1.2)
+    ax.fill_between(band_x, lower[-band_len:], upper[-band_len:], color=band_color, alpha=0.15, linewidth=0)
+    
+    trend_mode = cell['trend_mode']
+    if cell['pivots']:
+        zone = cell['pivots'][-1]
+        if trend_mode == "bullish":
+            zone_bottom, zone_top, zone_edge = zone['M2'], zone['PP'], '#4CAF50'
+        else:
+            zone_bottom, zone_top, zone_edge = zone['PP'], zone['M3'], '#F44336'
+        ax.add_patch(Rectangle((len(bars) + 0.5, zone_bottom), 6, zone_top - zone_bottom,
+                               facecolor=zone_edge, edgecolor=zone_edge, alpha=0.3, linewidth=0.8))
+    
+    score_color = '#2E7D32' if trend_mode == "bullish" else '#C62828'
+    ax.set_title(f"{cell['name']} ({cell['ticker']})  {cell['weighted_score']:.2f}", color=score_color, pad=3)
+    ax.set_xlim(-1, len(bars) + 7)
+    ax.set_xticks([])
+    ax.grid(True, axis='y', alpha=0.3, linestyle='--', linewidth=0.5)
+
+def draw_overview(cells):
+    """Рисует обзор по спецификациям ячеек (без pyplot, безопасно в воркерах)"""
+    cols = min(OVERVIEW_COLS, len(cells))
+    rows = int(np.ceil(len(cells) / cols))
+    
+    with matplotlib.rc_context(OVERVIEW_STYLE):
+        fig = Figure(figsize=(cols * 3.6, rows * 2.4), facecolor='white')
+        axes = fig.subplots(rows, cols, squeeze=False)
+        for ax, cell in zip(axes.flat, cells):
+            _draw_overview_cell(ax, cell)
+        for ax in axes.flat[len(cells):]:
+            ax.set_visible(False)
+        fig.subplots_adjust(left=0.04, right=0.99, top=0.95, bottom=0.03, wspace=0.22, hspace=0.35)
+    
+    return fig
+
+def generate_overview_chart(items):
+    """Обзор нескольких активов в одной фигуре (small multiples).
+    
+    items: список (name, ticker, levels), где levels - результат compute_chart_levels.
+    """
+    return draw_overview([overview_cell_spec(levels, name, ticker) for name, ticker, levels in items])
\ No newline at end of file
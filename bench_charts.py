@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Замер рендера графиков на синтетических данных (без обращения к Yahoo)
+  - один обзор (small multiples) против N полных графиков
+  - время кодирования и размер одного графика по форматам и пресетам DPI
+
+    python bench_charts.py --assets 16
+"""
+
+import argparse
+import time
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from app.utils import aggregate_bars, compute_chart_levels, chart_spec, draw_chart, generate_overview_chart
+from app.render_pool import encode_figure, IMAGE_FORMATS, DPI_PRESETS
+
+
+def synthetic_bars(seed, periods=730 * 24):
+    """Случайное блуждание часовых баров"""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(end=pd.Timestamp.now(tz='UTC').floor('h'), periods=periods, freq='1h')
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.004, periods)))
+    open_ = np.r_[close[0], close[:-1]]
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) * (1 + rng.uniform(0, 0.003, periods)),
+        'Low': np.minimum(open_, close) * (1 - rng.uniform(0, 0.003, periods)),
+        'Close': close,
+        'Volume': rng.integers(1, 1000, periods)
+    }, index=index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер рендера графиков')
+    parser.add_argument('--assets', type=int, default=16, help='Количество активов (по умолчанию: 16)')
+    args = parser.parse_args()
+
+    frames = [synthetic_bars(seed) for seed in range(args.assets)]
+
+    items = [(f"Asset {i}", f"A{i}", compute_chart_levels(aggregate_bars(df.copy()))) for i, df in enumerate(frames)]
+
+    started = time.perf_counter()
+    full_bytes = 0
+    for name, ticker, levels in items:
+        full_bytes += len(encode_figure(draw_chart(chart_spec(levels, name, ticker))))
+    full_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    overview_bytes = len(encode_figure(generate_overview_chart(items), dpi=DPI_PRESETS['overview']['screen']))
+    overview_seconds = time.perf_counter() - started
+
+    print("=" * 60)
+    print(f"{args.assets} полных графиков: {full_bytes / 1024:8.0f} KB  {full_seconds * 1000:8.0f} ms")
+    print(f"Один обзор:            {overview_bytes / 1024:8.0f} KB  {overview_seconds * 1000:8.0f} ms")
+    print(f"Выигрыш:               {full_bytes / overview_bytes:8.1f}x   {full_seconds / overview_seconds:8.1f}x")
+    print("=" * 60)
+
+    # Кодирование одного графика: прежний PNG (dpi=120, tight) против форматов и пресетов
+    spec = chart_spec(items[0][2], items[0][0], items[0][1])
+    print(f"{'Формат':<26}{'KB':>8}{'ms':>9}")
+    fig = draw_chart(spec)
+    started = time.perf_counter()
+    fig.tight_layout()
+    buf = BytesIO()
+    fig.savefig(buf, format='png', dpi=120, bbox_inches='tight', facecolor='white')
+    print(f"{'png 120dpi tight (было)':<26}{len(buf.getvalue()) / 1024:8.0f}{(time.perf_counter() - started) * 1000:9.0f}")
+    for fmt in IMAGE_FORMATS:
+        for preset, dpi in DPI_PRESETS['chart'].items():
+            fig = draw_chart(spec)
+            started = time.perf_counter()
+            size = len(encode_figure(fig, fmt, dpi))
+            label = f"{fmt} {preset}" if fmt != "svg" else "svg"
+            print(f"{label:<26}{size / 1024:8.0f}{(time.perf_counter() - started) * 1000:9.0f}")
+            if fmt == "svg":
+                break
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()